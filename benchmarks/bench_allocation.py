@@ -0,0 +1,242 @@
+"""Time allocation in the domain, through the repository and over HTTP.
+
+    python -m benchmarks.bench_allocation --skus 100 --batches-per-sku 10 \\
+        --output results.json
+    python -m benchmarks.bench_allocation --compare results.json
+
+Scenarios, each against its own freshly generated warehouse:
+
+    domain_product   Product.allocate on products held in memory
+    domain_function  model.allocate over a plain list of a SKU's batches
+    repository       services.allocate, a session per order, SQLite in memory
+    http             POST /allocate through the Flask test client
+
+The domain scenarios run before the ORM mappers are started, so they time
+the plain classes.  With --compare, results are checked against an earlier
+run and the exit status is 1 if any scenario got slower than --tolerance
+allows.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from benchmarks.warehouse import generate_orders, generate_warehouse
+from domain_modelling.domain import model
+
+
+def timed_each(fn, items):
+    durations = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarise(scenario, durations):
+    percentiles = statistics.quantiles(durations, n=100)
+    return {
+        "scenario": scenario,
+        "ops": len(durations),
+        "ops_per_second": len(durations) / sum(durations),
+        "mean_ms": statistics.mean(durations) * 1000,
+        "p50_ms": percentiles[49] * 1000,
+        "p95_ms": percentiles[94] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+    }
+
+
+def bench_domain(args):
+    by_sku = defaultdict(list)
+    for batch in generate_warehouse(**warehouse_args(args)):
+        by_sku[batch.sku].append(batch)
+    products = {sku: model.Product(sku, batches) for sku, batches in by_sku.items()}
+    yield summarise(
+        "domain_product",
+        timed_each(lambda line: products[line.sku].allocate(line), orders(args)),
+    )
+
+    by_sku = defaultdict(list)
+    for batch in generate_warehouse(**warehouse_args(args)):
+        by_sku[batch.sku].append(batch)
+    yield summarise(
+        "domain_function",
+        timed_each(lambda line: model.allocate(line, by_sku[line.sku]), orders(args)),
+    )
+
+
+# one in-memory database shared by every thread and session
+SQLITE_ENGINE_OPTIONS = dict(
+    poolclass=StaticPool, connect_args={"check_same_thread": False}
+)
+
+
+def stocked_session_factory(args):
+    from domain_modelling.adapters import orm
+
+    orm.start_mappers()
+    get_session = sessionmaker(bind=create_engine("sqlite://", **SQLITE_ENGINE_OPTIONS))
+    stock(get_session, args)
+    return get_session
+
+
+def stock(get_session, args):
+    from domain_modelling.adapters import orm, repository
+
+    session = get_session()
+    orm.metadata.create_all(session.connection())
+    repo = repository.SqlAlchemyRepository(session)
+    for batch in generate_warehouse(**warehouse_args(args)):
+        repo.add(batch)
+    session.commit()
+    session.close()
+
+
+def bench_repository(args):
+    from domain_modelling.adapters import repository
+    from domain_modelling.service_layer import services
+    from domain_modelling.service_layer.unit_of_work import session_scope
+
+    get_session = stocked_session_factory(args)
+
+    def allocate(line):
+        with session_scope(get_session) as session:
+            repo = repository.SqlAlchemyRepository(session)
+            services.allocate(line, repo, session)
+
+    yield summarise("repository", timed_each(allocate, orders(args)))
+
+
+def bench_http(args):
+    from domain_modelling.entrypoints import flask_app
+
+    app = flask_app.create_app(
+        {"database_uri": "sqlite://", "engine_options": SQLITE_ENGINE_OPTIONS}
+    )
+    stock(app.extensions["allocation"].database.get_session, args)
+    client = app.test_client()
+
+    def allocate(line):
+        response = client.post(
+            "/allocate",
+            json={"orderid": line.orderid, "sku": line.sku, "qty": line.qty},
+        )
+        assert response.status_code == 201, response.get_json()
+
+    yield summarise("http", timed_each(allocate, orders(args)))
+
+
+SCENARIOS = {
+    "domain": bench_domain,
+    "repository": bench_repository,
+    "http": bench_http,
+}
+
+
+def warehouse_args(args):
+    return {
+        "skus": args.skus,
+        "batches_per_sku": args.batches_per_sku,
+        "allocations_per_batch": args.allocations_per_batch,
+        "seed": args.seed,
+    }
+
+
+def orders(args):
+    # generated per scenario, as OrderLines made before the mappers started
+    # can't be persisted
+    return generate_orders(args.skus, args.orders, seed=args.seed)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Print each scenario's speed relative to baseline; True if none regressed.
+
+    Speeds are compared on median latency, which is much steadier between
+    runs than the mean on a busy machine.
+    """
+    before = {result["scenario"]: result for result in baseline["results"]}
+    ok = True
+    for result in results:
+        if result["scenario"] not in before:
+            continue
+        speedup = before[result["scenario"]]["p50_ms"] / result["p50_ms"]
+        regressed = speedup < 1 - tolerance
+        ok = ok and not regressed
+        print(
+            f"{result['scenario']:<16} {speedup:6.2f}x baseline"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skus", type=int, default=100)
+    parser.add_argument("--batches-per-sku", type=int, default=10)
+    parser.add_argument("--allocations-per-batch", type=int, default=5)
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--scenario", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="an earlier --output file to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="slowdown in median latency allowed before --compare fails",
+    )
+    args = parser.parse_args()
+
+    results = []
+    # SCENARIOS is ordered so the domain runs before anything starts the mappers
+    for name in SCENARIOS:
+        if name not in args.scenario:
+            continue
+        for result in SCENARIOS[name](args):
+            results.append(result)
+            print(
+                f"{result['scenario']:<16} {result['ops_per_second']:9.0f} ops/s"
+                f"  p50 {result['p50_ms']:7.3f}ms  p95 {result['p95_ms']:7.3f}ms"
+                f"  p99 {result['p99_ms']:7.3f}ms"
+            )
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "parameters": {**warehouse_args(args), "orders": args.orders},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["parameters"] != report["parameters"]:
+            print(f"warning: baseline was run with {baseline['parameters']}")
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Time LocalFileSystem.copy against shutil.copy on small and large files.
+
+    python -m benchmarks.bench_copy --workload small large
+
+For each workload a tree is generated, hashed into a HashCache (as sync
+does before copying) and then copied file by file with shutil.copy,
+LocalFileSystem with that warm cache (kernel-side copies) and
+LocalFileSystem without a cache (copy and hash in one userspace pass).
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.treegen import generate_tree
+from domain_modelling.sync import HashCache, LocalFileSystem, read_paths_and_hashes
+
+KB, MB = 1024, 1024 * 1024
+WORKLOADS = {
+    "small": {"files": 2000, "sizes": [1 * KB, 4 * KB, 16 * KB]},
+    "large": {"files": 8, "sizes": [64 * MB, 128 * MB]},
+}
+
+
+def copy_tree(tree, dest, copy):
+    dest.mkdir()
+    start = time.perf_counter()
+    for source in sorted(tree.rglob("*")):
+        if source.is_file():
+            copy(source, dest / source.name)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(dest)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workload", nargs="+", choices=sorted(WORKLOADS), default=sorted(WORKLOADS)
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.workload:
+        workload = WORKLOADS[name]
+        with tempfile.TemporaryDirectory() as tmp:
+            tree = Path(tmp, "tree")
+            total = generate_tree(tree, workload["files"], workload["sizes"])
+            with HashCache(Path(tmp, "hashes.db")) as cache:
+                read_paths_and_hashes(tree, cache=cache)
+                timings = {
+                    "shutil_copy": copy_tree(tree, Path(tmp, "a"), shutil.copy),
+                    "kernel_copy": copy_tree(
+                        tree, Path(tmp, "b"), LocalFileSystem(cache).copy
+                    ),
+                    "hashing_copy": copy_tree(
+                        tree, Path(tmp, "c"), LocalFileSystem().copy
+                    ),
+                }
+        result = {"workload": name, "files": workload["files"], "bytes": total}
+        result.update({f"{k}_seconds": v for k, v in timings.items()})
+        results.append(result)
+        print(
+            f"{name:<6} {workload['files']} files, {total / MB:.1f} MiB: "
+            + "  ".join(
+                f"{k} {v:.3f}s ({total / MB / v:.0f} MiB/s)" for k, v in timings.items()
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
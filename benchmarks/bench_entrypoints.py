@@ -0,0 +1,100 @@
+"""Compare the Flask and ASGI /allocate entrypoints under concurrent load.
+
+Both apps must be running against the same database, e.g.
+
+    flask --app domain_modelling/entrypoints/flask_app.py run --port 5005
+    uvicorn --factory domain_modelling.entrypoints.asgi_app:create_app --port 5006
+    python -m benchmarks.bench_entrypoints \\
+        --app flask=http://localhost:5005 --app asgi=http://localhost:5006
+
+Every run allocates against its own freshly stocked SKUs, spread so that
+requests mostly hit different products, and reports throughput and
+latency percentiles per app and concurrency level.
+"""
+import argparse
+import json
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from domain_modelling import config
+from domain_modelling.adapters import orm, repository
+from domain_modelling.domain import model
+
+
+def stock_skus(get_session, count, qty):
+    session = get_session()
+    repo = repository.SqlAlchemyRepository(session)
+    skus = [f"bench-{uuid.uuid4().hex[:8]}" for _ in range(count)]
+    for sku in skus:
+        repo.add(model.Batch(f"batch-{sku}", sku, qty, eta=None))
+    session.commit()
+    session.close()
+    return skus
+
+
+def run(url, skus, concurrency, total):
+    http = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    http.mount("http://", adapter)
+
+    def one(i):
+        body = {"orderid": f"order-{i}", "sku": skus[i % len(skus)], "qty": 1}
+        start = time.perf_counter()
+        r = http.post(f"{url}/allocate", json=body)
+        return time.perf_counter() - start, r.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": sum(1 for _, status in results if status != 201),
+        "requests_per_second": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--app", action="append", required=True, help="name=base_url, repeatable"
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--skus", type=int, default=200)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    orm.start_mappers()
+    get_session = sessionmaker(bind=create_engine(config.get_postgres_uri()))
+    apps = dict(app.split("=", 1) for app in args.app)
+    results = []
+    for name, url in apps.items():
+        for concurrency in args.concurrency:
+            skus = stock_skus(get_session, args.skus, qty=args.requests)
+            result = {"app": name, **run(url, skus, concurrency, args.requests)}
+            results.append(result)
+            print(
+                f"{name:>8} c={concurrency:<4} {result['requests_per_second']:8.1f} req/s"
+                f"  p50 {result['p50_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms"
+                f"  errors {result['errors']}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Time read_paths_and_hashes cold and warm against a persistent HashCache.
+
+    python -m benchmarks.bench_hash_cache --files 2000 --workers 1 8
+
+Reports, for each worker count, the time to hash a generated tree without a
+cache, with an empty cache (cold) and with the cache it just filled (warm).
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.treegen import generate_tree
+from domain_modelling.sync import HashCache, read_paths_and_hashes
+
+KB, MB = 1024, 1024 * 1024
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[4 * KB, 64 * KB, 512 * KB, 4 * MB],
+        help="file sizes in bytes, drawn uniformly",
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = Path(tmp, "tree")
+        total = generate_tree(tree, args.files, args.sizes)
+        print(f"{args.files} files, {total / MB:.1f} MiB")
+
+        for workers in args.workers:
+            db = Path(tmp, f"hashes-{workers}.db")
+            uncached = timed(lambda: read_paths_and_hashes(tree, workers=workers))
+            with HashCache(db) as cache:
+                cold = timed(
+                    lambda: read_paths_and_hashes(tree, cache=cache, workers=workers)
+                )
+            with HashCache(db) as cache:
+                warm = timed(
+                    lambda: read_paths_and_hashes(tree, cache=cache, workers=workers)
+                )
+            result = {
+                "workers": workers,
+                "files": args.files,
+                "bytes": total,
+                "uncached_seconds": uncached,
+                "cold_seconds": cold,
+                "warm_seconds": warm,
+            }
+            results.append(result)
+            print(
+                f"workers={workers:<3} uncached {uncached:7.3f}s"
+                f"  cold {cold:7.3f}s  warm {warm:7.3f}s"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Measure hash_file throughput per backend and block size.
+
+    python -m benchmarks.bench_hashing --distribution small large
+
+For each file size distribution a tree is generated once, read once to get
+it into the page cache, and then hashed file by file with every backend and
+block size.  Throughput is reported in MiB/s; "auto" is hash_file's own
+choice of backend.
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.treegen import generate_tree
+from domain_modelling.sync import HASH_BACKENDS, hash_file
+
+KB, MB = 1024, 1024 * 1024
+DISTRIBUTIONS = {
+    "small": {"files": 4000, "sizes": [1 * KB, 4 * KB, 16 * KB, 64 * KB]},
+    "medium": {"files": 200, "sizes": [256 * KB, 1 * MB, 4 * MB]},
+    "large": {"files": 6, "sizes": [32 * MB, 64 * MB, 256 * MB]},
+    "mixed": {"files": 500, "sizes": [4 * KB, 64 * KB, 1 * MB, 16 * MB]},
+}
+
+
+def throughput(files, total, **kwargs):
+    start = time.perf_counter()
+    for path in files:
+        hash_file(path, **kwargs)
+    return total / MB / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--distribution",
+        nargs="+",
+        choices=sorted(DISTRIBUTIONS),
+        default=sorted(DISTRIBUTIONS),
+    )
+    parser.add_argument(
+        "--blocksizes", type=int, nargs="+", default=[64 * KB, 256 * KB, 1 * MB]
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.distribution:
+        distribution = DISTRIBUTIONS[name]
+        with tempfile.TemporaryDirectory() as tmp:
+            tree = Path(tmp, "tree")
+            total = generate_tree(tree, distribution["files"], distribution["sizes"])
+            files = sorted(path for path in tree.rglob("*") if path.is_file())
+            throughput(files, total)  # warm the page cache
+
+            for blocksize in args.blocksizes:
+                for backend in [None, *sorted(HASH_BACKENDS)]:
+                    mib_per_second = throughput(
+                        files, total, blocksize=blocksize, backend=backend
+                    )
+                    results.append(
+                        {
+                            "distribution": name,
+                            "files": distribution["files"],
+                            "bytes": total,
+                            "blocksize": blocksize,
+                            "backend": backend or "auto",
+                            "mib_per_second": mib_per_second,
+                        }
+                    )
+                    print(
+                        f"{name:<7} blocksize={blocksize // KB:>5}KiB"
+                        f" {backend or 'auto':<9} {mib_per_second:8.0f} MiB/s"
+                    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Track how long a fresh worker takes to import and build the Flask app.
+
+    python -m benchmarks.bench_import --output startup.json
+    python -m benchmarks.bench_import --compare startup.json
+
+Every run is a new interpreter, so nothing is cached in memory; the
+bytecode cache on disk is warmed up by the first run.  Each run reports
+the time to import the entrypoint and then to call create_app against an
+in-memory SQLite database, which includes mapping the model but not
+connecting.  One further run under `python -X importtime` breaks the import
+down by top-level package.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+from benchmarks.bench_allocation import git_commit
+
+MODULE = "domain_modelling.entrypoints.flask_app"
+
+STARTUP = f"""
+import json, time
+start = time.perf_counter()
+from {MODULE} import create_app
+imported = time.perf_counter()
+create_app({{"database_uri": "sqlite://", "engine_options": {{}}, "warm_up": False}})
+created = time.perf_counter()
+print(json.dumps({{"import": imported - start, "create_app": created - imported}}))
+"""
+
+
+def time_startup():
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output)
+
+
+def import_breakdown():
+    """Milliseconds spent importing each top-level package's own modules."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    totals = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, _, name = line[len("import time:") :].split("|")
+        totals[name.strip().split(".")[0]] += int(own) / 1000
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="an earlier --output file to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="slowdown in median startup allowed before --compare fails",
+    )
+    args = parser.parse_args()
+
+    time_startup()  # compiles any stale bytecode
+    runs = [time_startup() for _ in range(args.runs)]
+    results = {
+        phase: statistics.median(run[phase] for run in runs) * 1000
+        for phase in ("import", "create_app")
+    }
+    results["total"] = results["import"] + results["create_app"]
+    for phase, ms in results.items():
+        print(f"{phase:<12} {ms:8.1f}ms")
+    print()
+    breakdown = import_breakdown()
+    for package, ms in breakdown.most_common(args.top):
+        print(f"  {package:<24} {ms:8.1f}ms")
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "startup_ms": results,
+        "imports_ms": dict(breakdown),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["startup_ms"]["total"]
+        speedup = baseline / results["total"]
+        print(f"\nstartup {speedup:.2f}x baseline")
+        if speedup < 1 - args.tolerance:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Measure how many bytes each OrderLine and Batch takes.
+
+    python -m benchmarks.bench_memory --count 100000
+    python -m benchmarks.bench_memory --count 100000 --mapped
+
+Strings and dates are built before measuring, so the figures are the cost
+of the objects themselves (and, for batches, their empty allocation set).
+With --mapped the ORM mappers are started first, which gives every instance
+SQLAlchemy's instance state and dict.
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from datetime import date
+
+from domain_modelling.domain import model
+
+
+def bytes_per_object(make, args):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [make(*a) for a in args]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # the list holding them costs one pointer per object
+    return (after - before) / len(objects) - 8
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--mapped", action="store_true")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.mapped:
+        from domain_modelling.adapters import orm
+
+        orm.start_mappers()
+
+    line_args = [(f"order-{i}", f"SKU-{i % 1000}", i % 20) for i in range(args.count)]
+    today = date.today()
+    batch_args = [
+        (f"batch-{i}", f"SKU-{i % 1000}", 100, today) for i in range(args.count)
+    ]
+    result = {
+        "mapped": args.mapped,
+        "count": args.count,
+        "bytes_per_line": bytes_per_object(model.OrderLine, line_args),
+        "bytes_per_batch": bytes_per_object(model.Batch, batch_args),
+    }
+    print(
+        f"{'mapped' if args.mapped else 'unmapped'}:"
+        f" {result['bytes_per_line']:.0f} bytes per OrderLine,"
+        f" {result['bytes_per_batch']:.0f} bytes per Batch"
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
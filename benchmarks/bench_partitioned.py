@@ -0,0 +1,84 @@
+"""Measure PartitionedAllocator throughput as workers are added.
+
+    python -m benchmarks.bench_partitioned --workers 1 2 4 8 --clients 32
+
+Each run stocks a fresh SQLite file, then --clients threads allocate
+--orders lines between them through a pool of that many workers.  Each
+reply waits for the commit covering it, so the time includes every write.
+With orders spread evenly over the SKUs, throughput should grow roughly
+with the number of workers until the workers outnumber the cores, or the
+front end's queue handling becomes the bottleneck.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.warehouse import generate_orders, generate_warehouse
+from domain_modelling.adapters import orm, repository
+from domain_modelling.domain import model
+from domain_modelling.service_layer.partitioned import PartitionedAllocator
+
+
+def stock(database_uri, args):
+    engine = create_engine(database_uri)
+    orm.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    repo = repository.SqlAlchemyRepository(session)
+    for batch in generate_warehouse(args.skus, args.batches_per_sku, 0, args.seed):
+        repo.add(batch)
+    session.commit()
+    session.close()
+    engine.dispose()
+
+
+def run(workers, args):
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = f"sqlite:///{os.path.join(directory, 'allocation.db')}"
+        stock(database_uri, args)
+        lines = generate_orders(args.skus, args.orders, seed=args.seed)
+        allocator = PartitionedAllocator(
+            database_uri, workers=workers, flush_interval=args.flush_interval
+        )
+        try:
+            # the first allocation for each SKU loads it; keep that out of it
+            for s in range(args.skus):
+                allocator.allocate(model.OrderLine(f"warm-up-{s}", f"SKU-{s:06d}", 1))
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.clients) as clients:
+                list(clients.map(allocator.allocate, lines))
+            allocator.flush()
+            return time.perf_counter() - start
+        finally:
+            allocator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--skus", type=int, default=100)
+    parser.add_argument("--batches-per-sku", type=int, default=10)
+    parser.add_argument("--orders", type=int, default=20_000)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    orm.start_mappers()
+    baseline = None
+    for workers in args.workers:
+        elapsed = run(workers, args)
+        throughput = args.orders / elapsed
+        baseline = baseline or throughput
+        print(
+            f"{workers:3d} workers  {throughput:9.0f} allocations/s"
+            f"  {throughput / baseline:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""Generate directory trees of random files for the sync benchmarks."""
+import os
+import random
+from pathlib import Path
+
+
+def generate_tree(root, files, sizes, fanout=50, seed=0):
+    """Write `files` files under `root`, each with a size drawn from `sizes`.
+
+    Files are spread over subdirectories of `fanout` files each, and their
+    contents are random so no two files hash the same.
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    total = 0
+    for i in range(files):
+        folder = root / f"dir{i // fanout:05d}"
+        folder.mkdir(parents=True, exist_ok=True)
+        size = rng.choice(sizes)
+        (folder / f"file{i:07d}.bin").write_bytes(os.urandom(size))
+        total += size
+    return total
@@ -0,0 +1,44 @@
+"""Generate synthetic warehouses for the allocation benchmarks."""
+import random
+from datetime import date, timedelta
+
+from domain_modelling.domain import model
+
+
+def generate_warehouse(skus, batches_per_sku, allocations_per_batch, seed=0):
+    """Return a list of batches spread over `skus` SKUs.
+
+    Roughly a third of each SKU's batches are in the warehouse already
+    (eta None) and the rest are shipments due over the next few months.
+    Each batch starts with `allocations_per_batch` order lines allocated to
+    it and plenty of stock left, so benchmark orders never run out.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    batches = []
+    for s in range(skus):
+        sku = f"SKU-{s:06d}"
+        for b in range(batches_per_sku):
+            eta = None
+            if rng.random() > 1 / 3:
+                eta = today + timedelta(days=rng.randint(1, 90))
+            batch = model.Batch(
+                f"batch-{s:06d}-{b:04d}", sku, rng.randint(10**5, 10**6), eta
+            )
+            for a in range(allocations_per_batch):
+                batch.allocate(
+                    model.OrderLine(f"order-{s}-{b}-{a}", sku, rng.randint(1, 20))
+                )
+            batches.append(batch)
+    return batches
+
+
+def generate_orders(skus, count, seed=0):
+    """Return `count` small order lines for SKUs drawn uniformly."""
+    rng = random.Random(seed)
+    return [
+        model.OrderLine(
+            f"bench-order-{i}", f"SKU-{rng.randrange(skus):06d}", rng.randint(1, 10)
+        )
+        for i in range(count)
+    ]
@@ -0,0 +1,73 @@
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from domain_modelling.adapters.repository import AbstractAsyncRepository
+from domain_modelling.domain import model
+
+
+class AsyncSqlAlchemyRepository(AbstractAsyncRepository):
+    """SqlAlchemyRepository for an AsyncSession: the same methods, awaited.
+
+    An AsyncSession can't lazy-load, so everything the domain model touches
+    (a product's batches and their allocations) is loaded up front.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def _with_batches(self):
+        return selectinload(model.Product.batches).selectinload(
+            model.Batch._allocations
+        )
+
+    async def add(self, batch):
+        product = await self.session.get(
+            model.Product, batch.sku, options=[self._with_batches()]
+        )
+        if product is None:
+            self.session.add(model.Product(batch.sku, [batch]))
+        else:
+            product.add_batch(batch)
+        self.session.add(batch)
+
+    async def get(self, reference):
+        result = await self.session.execute(
+            select(model.Batch)
+            .filter_by(reference=reference)
+            .options(selectinload(model.Batch._allocations))
+        )
+        return result.scalar_one()
+
+    async def list_by_sku(self, sku):
+        result = await self.session.execute(
+            select(model.Batch)
+            .filter_by(sku=sku)
+            .options(selectinload(model.Batch._allocations))
+        )
+        return result.scalars().all()
+
+    async def get_product(self, sku):
+        result = await self.session.execute(
+            select(model.Product)
+            .filter_by(sku=sku)
+            .options(self._with_batches())
+            # after a rollback the product is still in the identity map, but
+            # expired; make sure it comes back with fresh batches
+            .execution_options(populate_existing=True)
+        )
+        return result.scalars().first()
+
+    async def get_allocated_batch(self, orderid, sku):
+        result = await self.session.execute(
+            select(model.Batch)
+            .join(model.Batch._allocations)
+            .filter(model.OrderLine.orderid == orderid, model.OrderLine.sku == sku)
+            .options(selectinload(model.Batch._allocations))
+        )
+        return result.scalars().first()
+
+    async def get_version(self, sku):
+        result = await self.session.execute(
+            select(model.Product.version_number).filter_by(sku=sku)
+        )
+        return result.scalar()
@@ -0,0 +1,93 @@
+"""Set-based batch upserts for bulk stock ingestion.
+
+These write straight to the tables rather than through the ORM, so each
+one also bumps version_number on every product it touches: sessions still
+holding those products, and the product cache, then see them as stale.
+
+The upserts need a unique constraint or index on batches.reference, which
+tables created before it was added don't have; orm.create_schema adds it.
+"""
+import csv
+import io
+from typing import List
+
+from sqlalchemy import text
+
+_COLUMNS = "reference, sku, _purchased_quantity, eta"
+_UPSERT = (
+    "ON CONFLICT (reference) DO UPDATE SET"
+    " _purchased_quantity = excluded._purchased_quantity, eta = excluded.eta"
+)
+
+
+def load_batches(session, rows: List[dict]) -> None:
+    """Insert or update rows (reference, sku, qty, eta) and their products.
+
+    A batch's sku never changes once it exists; only its quantity and eta
+    are updated.  References must be unique within rows.
+    """
+    if session.get_bind().dialect.driver == "psycopg2":
+        _load_with_copy(session.connection(), rows)
+    else:
+        _load_with_executemany(session.connection(), rows)
+
+
+def _load_with_executemany(connection, rows):
+    skus = [{"sku": sku} for sku in sorted({row["sku"] for row in rows})]
+    connection.execute(
+        text("INSERT INTO products (sku) VALUES (:sku) ON CONFLICT DO NOTHING"), skus
+    )
+    connection.execute(
+        text(
+            "UPDATE products SET version_number = version_number + 1 WHERE sku = :sku"
+        ),
+        skus,
+    )
+    connection.execute(
+        text(
+            f"INSERT INTO batches ({_COLUMNS}) VALUES (:reference, :sku, :qty, :eta) "
+            + _UPSERT
+        ),
+        rows,
+    )
+
+
+def _load_with_copy(connection, rows):
+    connection.execute(
+        text(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS batches_feed ("
+            " reference VARCHAR(255), sku VARCHAR(255),"
+            " _purchased_quantity INTEGER, eta DATE)"
+        )
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        eta = row["eta"].isoformat() if row["eta"] else ""
+        writer.writerow((row["reference"], row["sku"], row["qty"], eta))
+    buffer.seek(0)
+    with connection.connection.cursor() as cursor:
+        # an unquoted empty field is NULL in CSV-format COPY
+        cursor.copy_expert(
+            f"COPY batches_feed ({_COLUMNS}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+
+    connection.execute(
+        text(
+            "INSERT INTO products (sku) SELECT DISTINCT sku FROM batches_feed "
+            "ON CONFLICT DO NOTHING"
+        )
+    )
+    connection.execute(
+        text(
+            "UPDATE products SET version_number = version_number + 1 "
+            "WHERE sku IN (SELECT sku FROM batches_feed)"
+        )
+    )
+    connection.execute(
+        text(
+            f"INSERT INTO batches ({_COLUMNS}) SELECT {_COLUMNS} FROM batches_feed "
+            + _UPSERT
+        )
+    )
+    connection.execute(text("TRUNCATE batches_feed"))
@@ -1,6 +1,18 @@
 import logging
+import threading
 
-from sqlalchemy import Column, Date, ForeignKey, Integer, MetaData, String, Table, event
+from sqlalchemy import (
+    Column,
+    Date,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    event,
+    inspect,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import mapper, relationship
 
@@ -17,7 +29,7 @@ order_lines = Table(
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("sku", String(255)),
     Column("qty", Integer, nullable=False),
-    Column("orderid", String(255)),
+    Column("orderid", String(255), index=True),
 )
 
 products = Table(
@@ -31,9 +43,8 @@ batches = Table(
     "batches",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("reference", String(255)),
-    # Column("sku", ForeignKey("products.sku")),
-    Column("sku", String(255)),
+    Column("reference", String(255), unique=True),
+    Column("sku", ForeignKey("products.sku"), index=True),
     Column("_purchased_quantity", Integer, nullable=False),
     Column("eta", Date, nullable=True),
 )
@@ -41,12 +52,50 @@ allocations = Table(
     "allocations",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("orderline_id", ForeignKey("order_lines.id")),
-    Column("batch_id", ForeignKey("batches.id")),
+    Column("orderline_id", ForeignKey("order_lines.id"), index=True),
+    Column("batch_id", ForeignKey("batches.id"), index=True),
 )
 
 
+_mapping_lock = threading.Lock()
+
+
+def create_schema(connection):
+    """Create the tables, and bring ones created by older versions up to date.
+
+    create_all leaves existing tables alone, so a batches table from before
+    batches.reference was unique gets the unique index that add_batches'
+    upserts rely on added here.  That fails if the table already holds
+    duplicate references; they have to be merged by hand first.
+    """
+    metadata.create_all(connection)
+    if not _is_unique(connection, "batches", ["reference"]):
+        logger.info("Adding unique index on batches.reference")
+        connection.execute(
+            text("CREATE UNIQUE INDEX batches_reference_key ON batches (reference)")
+        )
+
+
+def _is_unique(connection, table, columns):
+    inspector = inspect(connection)
+    return any(
+        constraint["column_names"] == columns
+        for constraint in inspector.get_unique_constraints(table)
+    ) or any(
+        index["unique"] and index["column_names"] == columns
+        for index in inspector.get_indexes(table)
+    )
+
+
 def start_mappers():
+    """Map the domain model onto the tables, unless it already is."""
+    with _mapping_lock:
+        if inspect(model.Batch, raiseerr=False) is not None:
+            return
+        _map_model()
+
+
+def _map_model():
     logger.info("Starting mappers")
     lines_mapper = mapper(model.OrderLine, order_lines)
     batches_mapper = mapper(
@@ -60,5 +109,50 @@ def start_mappers():
             )
         },
     )
+    mapper(
+        model.Product,
+        products,
+        properties={"batches": relationship(batches_mapper)},
+        # the domain bumps version_number itself; SQLAlchemy only checks that
+        # the row still holds the version we loaded, so a concurrent
+        # allocation against the same product fails with StaleDataError
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
+    )
+
+
+@event.listens_for(model.Batch, "load")
+def receive_batch_load(batch, _):
+    batch._allocated_quantity = None
+
+
+@event.listens_for(model.Batch, "refresh")
+def receive_batch_refresh(batch, _, attrs):
+    if attrs is None or "_allocations" in attrs:
+        batch._allocated_quantity = None
+
+
+@event.listens_for(model.Batch, "expire")
+def receive_batch_expire(batch, attrs):
+    # a rollback or commit throws away _allocations; the running total has to
+    # go with it or it would outlive the rows it was counted from.  batch is
+    # None when the session only held a weak reference to it
+    if batch is not None and (attrs is None or "_allocations" in attrs):
+        batch._allocated_quantity = None
+
+
+@event.listens_for(model.Product, "load")
+def receive_product_load(product, _):
+    product._allocation_index = None
+
+
+@event.listens_for(model.Product, "refresh")
+def receive_product_refresh(product, _, attrs):
+    if attrs is None or "batches" in attrs:
+        product._allocation_index = None
+
 
-    # mapper()
+@event.listens_for(model.Product, "expire")
+def receive_product_expire(product, attrs):
+    if product is not None and (attrs is None or "batches" in attrs):
+        product._allocation_index = None
@@ -1,41 +1,349 @@
 import abc
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import joinedload, lazyload, selectinload, subqueryload
+
+from domain_modelling import instrumentation
 from domain_modelling.domain import model
 
+# how SqlAlchemyRepository loads products' batches and batches' allocations
+LOADING_STRATEGIES = {
+    "lazy": lazyload,
+    "selectin": selectinload,
+    "joined": joinedload,
+    "subquery": subqueryload,
+}
+
 
 class AbstractRepository(abc.ABC):
     @abc.abstractmethod
     def add(self, batch: model.Batch):
         raise NotImplementedError
 
+    # the query methods take an optional name from LOADING_STRATEGIES;
+    # repositories that never lazy-load are free to ignore it
+
+    @abc.abstractmethod
+    def get(self, reference, loading: Optional[str] = None) -> model.Batch:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_by_sku(self, sku, loading: Optional[str] = None) -> List[model.Batch]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_product(
+        self, sku, loading: Optional[str] = None
+    ) -> Optional[model.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_allocated_batch(
+        self, orderid, sku, loading: Optional[str] = None
+    ) -> Optional[model.Batch]:
+        raise NotImplementedError
+
     @abc.abstractmethod
-    def get(self, reference) -> model.Batch:
+    def get_version(self, sku) -> Optional[int]:
+        raise NotImplementedError
+
+
+class AbstractAsyncRepository(abc.ABC):
+    """AbstractRepository for an asyncio session: the same methods, awaited.
+
+    An async session can't lazy-load, so implementations load everything
+    the domain model touches up front and there is no loading option.
+    """
+
+    @abc.abstractmethod
+    async def add(self, batch: model.Batch):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get(self, reference) -> model.Batch:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def list_by_sku(self, sku) -> List[model.Batch]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_product(self, sku) -> Optional[model.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_allocated_batch(self, orderid, sku) -> Optional[model.Batch]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_version(self, sku) -> Optional[int]:
         raise NotImplementedError
 
 
 class SqlAlchemyRepository(AbstractRepository):
-    def __init__(self, session):
+    """Batches and products backed by a SQLAlchemy session.
+
+    `loading` names one of LOADING_STRATEGIES, used for the collections the
+    domain model walks when it allocates.  Anything but "lazy" loads them in
+    a fixed number of queries however many batches a product has; each query
+    method also takes `loading` to override it for that call.
+    """
+
+    def __init__(self, session, loading: str = "selectin"):
         self.session = session
+        self.loading = _check_loading(loading)
 
     def add(self, batch):
+        product = self.session.get(model.Product, batch.sku)
+        if product is None:
+            self.session.add(model.Product(batch.sku, [batch]))
+        else:
+            product.add_batch(batch)
         self.session.add(batch)
 
-    def get(self, reference):
-        return self.session.query(model.Batch).filter_by(reference=reference).one()
+    def get(self, reference, loading=None):
+        return self._batches(loading).filter_by(reference=reference).one()
+
+    def list(self, loading=None):
+        return self._batches(loading).all()
 
-    def list(self):
-        return self.session.query(model.Batch).all()
+    @instrumentation.timed("repository_seconds", method="list_by_sku")
+    def list_by_sku(self, sku, loading=None):
+        return self._batches(loading).filter_by(sku=sku).all()
+
+    @instrumentation.timed("repository_seconds", method="get_product")
+    def get_product(self, sku, loading=None):
+        return (
+            self.session.query(model.Product)
+            .options(
+                self._load(loading, model.Product.batches, model.Batch._allocations)
+            )
+            .filter_by(sku=sku)
+            .first()
+        )
+
+    @instrumentation.timed("repository_seconds", method="get_allocated_batch")
+    def get_allocated_batch(self, orderid, sku, loading=None):
+        return (
+            self._batches(loading)
+            .join(model.Batch._allocations)
+            .filter(model.OrderLine.orderid == orderid, model.OrderLine.sku == sku)
+            .first()
+        )
+
+    @instrumentation.timed("repository_seconds", method="get_version")
+    def get_version(self, sku):
+        return (
+            self.session.query(model.Product.version_number).filter_by(sku=sku).scalar()
+        )
+
+    def _batches(self, loading):
+        return self.session.query(model.Batch).options(
+            self._load(loading, model.Batch._allocations)
+        )
+
+    def _load(self, loading, *path):
+        loading = _check_loading(loading or self.loading)
+        option = LOADING_STRATEGIES[loading](path[0])
+        for attribute in path[1:]:
+            # Load objects chain with methods named after the functions
+            option = getattr(option, LOADING_STRATEGIES[loading].__name__)(attribute)
+        return option
+
+
+def _check_loading(loading):
+    if loading not in LOADING_STRATEGIES:
+        raise ValueError(f"Unknown loading strategy {loading!r}")
+    return loading
 
 
 class FakeRepository(AbstractRepository):
     def __init__(self, batches):
         self._batches = set(batches)
+        self._products = {}
 
     def add(self, batch):
         self._batches.add(batch)
+        if batch.sku in self._products:
+            self._products[batch.sku].add_batch(batch)
 
-    def get(self, reference):
+    def get(self, reference, loading=None):
         return next(b for b in self._batches if b.reference == reference)
 
-    def list(self):
+    def list(self, loading=None):
         return list(self._batches)
+
+    def list_by_sku(self, sku, loading=None):
+        return [b for b in self._batches if b.sku == sku]
+
+    def get_product(self, sku, loading=None):
+        batches = self.list_by_sku(sku)
+        if not batches:
+            return None
+        if sku not in self._products:
+            self._products[sku] = model.Product(sku, batches)
+        return self._products[sku]
+
+    def get_allocated_batch(self, orderid, sku, loading=None):
+        return next(
+            (b for b in self.list_by_sku(sku) if b.line_for(orderid) is not None),
+            None,
+        )
+
+    def get_version(self, sku):
+        product = self.get_product(sku)
+        return product.version_number if product is not None else None
+
+
+class ProductCache:
+    """Process-wide LRU of products, shared by every CachingRepository."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, model.Product]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def checkout(self, sku) -> Optional[model.Product]:
+        # taken out while in use, so two requests never share one product
+        with self._lock:
+            return self._entries.pop(sku, None)
+
+    def put(self, sku, product: model.Product) -> None:
+        with self._lock:
+            self._entries[sku] = product
+            self._entries.move_to_end(sku)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, sku) -> None:
+        with self._lock:
+            self._entries.pop(sku, None)
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class CachingRepository(AbstractRepository):
+    """Serve products from a ProductCache while their version is current.
+
+    Every lookup still reads the product's version_number, which is cheap; the
+    batches and allocations are only reloaded when it has moved on since the
+    cached copy was committed.  Products go back into the cache when the
+    session commits, so the session should be created with
+    expire_on_commit=False or every lookup will miss.  When it rolls back
+    instead, products the transaction didn't change go back too, so a SKU
+    that keeps answering OutOfStock stays cached; changed ones are dropped.
+    """
+
+    def __init__(self, inner: SqlAlchemyRepository, cache: ProductCache):
+        self._inner = inner
+        self._cache = cache
+        # products to put back once the current transaction ends, with the
+        # version they were handed out at
+        self._pending: Dict[str, Tuple[model.Product, int]] = {}
+        self._listening = False
+
+    def add(self, batch):
+        self._cache.discard(batch.sku)
+        self._inner.add(batch)
+
+    def get(self, reference, loading=None):
+        return self._inner.get(reference, loading)
+
+    def list_by_sku(self, sku, loading=None):
+        return self._inner.list_by_sku(sku, loading)
+
+    def get_allocated_batch(self, orderid, sku, loading=None):
+        return self._inner.get_allocated_batch(orderid, sku, loading)
+
+    def get_version(self, sku):
+        return self._inner.get_version(sku)
+
+    def get_product(self, sku, loading=None):
+        version = self._inner.get_version(sku)
+        if version is None:
+            self._cache.discard(sku)
+            return None
+
+        product = None
+        cached = self._cache.checkout(sku)
+        if cached is not None and self._loaded_version(cached) == version:
+            product = self._attach(cached)
+        self._cache.record(hit=product is not None)
+        if product is None:
+            product = self._inner.get_product(sku, loading)
+
+        self._listen()
+        self._pending[sku] = product, self._loaded_version(product)
+        return product
+
+    def _listen(self):
+        if not self._listening:
+            session = self._inner.session
+            event.listen(session, "after_commit", self._put_back_pending)
+            event.listen(session, "after_rollback", self._forget_pending)
+            self._listening = True
+
+    def _put_back_pending(self, _):
+        for sku, (product, _) in self._pending.items():
+            self._cache.put(sku, product)
+        self._pending.clear()
+
+    def _forget_pending(self, session):
+        # runs before the rollback expires the session's objects.  The domain
+        # bumps version_number on every change, so a product still at the
+        # version it was handed out at is as it was loaded; taking it out of
+        # the session keeps it that way
+        for sku, (product, version) in self._pending.items():
+            if self._loaded_version(product) == version:
+                self._detach(session, product)
+                self._cache.put(sku, product)
+        self._pending.clear()
+
+    @staticmethod
+    def _loaded_version(product):
+        # read the loaded state directly: products left behind by a rollback
+        # or an expiring commit have nothing loaded, and must not be refreshed
+        # through a session that may already be closed
+        return inspect(product).dict.get("version_number")
+
+    @staticmethod
+    def _detach(session, product):
+        # expunge doesn't cascade, and must not load anything that isn't
+        for batch in inspect(product).dict.get("batches", ()):
+            for line in inspect(batch).dict.get("_allocations", ()):
+                session.expunge(line)
+            session.expunge(batch)
+        session.expunge(product)
+
+    def _attach(self, product):
+        try:
+            return self._inner.session.merge(product, load=False)
+        except InvalidRequestError:
+            # still dirty in the session that is busy committing it
+            return None
@@ -0,0 +1,38 @@
+"""Streaming readers for purchase-order batch feeds.
+
+Both readers yield one dict per batch, with keys reference, sku, qty and
+eta (a date, or None for stock already in the warehouse), reading the file
+a line at a time.
+"""
+import csv
+import json
+from datetime import date
+from typing import IO, Iterator, Optional
+
+
+def read_csv(file: IO[str]) -> Iterator[dict]:
+    """Rows from a CSV file with a reference,sku,qty,eta header."""
+    for row in csv.DictReader(file):
+        yield _batch_row(row)
+
+
+def read_jsonl(file: IO[str]) -> Iterator[dict]:
+    """Rows from a file holding one JSON object per line."""
+    for line in file:
+        if line.strip():
+            yield _batch_row(json.loads(line))
+
+
+def _batch_row(record) -> dict:
+    return {
+        "reference": record["reference"],
+        "sku": record["sku"],
+        "qty": int(record["qty"]),
+        "eta": _parse_eta(record.get("eta")),
+    }
+
+
+def _parse_eta(value) -> Optional[date]:
+    if not value:
+        return None
+    return date.fromisoformat(value)
@@ -9,7 +9,60 @@ def get_postgres_uri():
     return f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
 
+def get_async_postgres_uri():
+    return get_postgres_uri().replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
 def get_api_url():
     host = os.environ.get("API_HOST", "localhost")
     port = 5005 if host == "localhost" else 80
     return f"http://{host}:{port}/"
+
+
+def get_pool_settings():
+    return dict(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "1") == "1",
+    )
+
+
+def get_product_cache_size():
+    # number of products each worker keeps in memory; 0 turns the cache off
+    return int(os.environ.get("PRODUCT_CACHE_SIZE", 0))
+
+
+def get_metrics_sink():
+    # "prometheus" serves /metrics, "log" logs every observation, anything
+    # else leaves instrumentation off
+    return os.environ.get("METRICS_SINK", "")
+
+
+def get_allocation_coalescing():
+    # how long, in milliseconds, the first /allocate for a SKU waits for
+    # others to commit alongside it, and how many it takes at most; a window
+    # of 0 allocates every request on its own
+    return dict(
+        window=float(os.environ.get("ALLOCATION_WINDOW_MS", 0)) / 1000,
+        max_group=int(os.environ.get("ALLOCATION_MAX_GROUP", 100)),
+    )
+
+
+def get_allocation_partitions():
+    # worker processes /allocate is spread over, each owning a share of the
+    # SKUs (see service_layer.partitioned); 0 allocates in the web process
+    return int(os.environ.get("ALLOCATION_PARTITIONS", 0))
+
+
+def get_loading_strategy():
+    # how the repository loads batches and allocations: selectin, joined,
+    # subquery or lazy (see repository.LOADING_STRATEGIES)
+    return os.environ.get("DB_LOADING_STRATEGY", "selectin")
+
+
+def get_warm_up():
+    # open the pool and compile the hot statements before serving; leave it
+    # off under a server that builds the app before forking its workers
+    return os.environ.get("WARM_UP", "0") == "1"
@@ -1,6 +1,11 @@
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
 from datetime import date
-from typing import List, Optional, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# when set, every read of Batch.allocated_quantity re-sums the allocations and
+# checks the running total against it; meant for tests, not production
+CHECK_ALLOCATED_QUANTITY = False
 
 
 @dataclass(unsafe_hash=True)
@@ -11,32 +16,60 @@ class OrderLine:
 
 
 class Batch:
+    # running total of _allocations; None means "rebuild on next read", which
+    # is also what batches loaded by the ORM start with
+    _allocated_quantity: Optional[int] = None
+
     def __init__(self, ref: str, sku: str, qty: int, eta: Optional[date]):
         self.reference = ref
         self.sku = sku
         self.eta = eta
         self._purchased_quantity = qty
         self._allocations = set()
+        self._allocated_quantity = 0
 
     def allocate(self, line: OrderLine) -> None:
-        if self.can_allocate(line):
+        if self.can_allocate(line) and line not in self._allocations:
+            allocated = self.allocated_quantity
             self._allocations.add(line)
+            self._allocated_quantity = allocated + line.qty
 
     def deallocate(self, line: OrderLine) -> None:
         if line in self._allocations:
+            allocated = self.allocated_quantity
             self._allocations.remove(line)
+            self._allocated_quantity = allocated - line.qty
 
     @property
     def allocated_quantity(self) -> int:
-        return sum(line.qty for line in self._allocations)
+        if self._allocated_quantity is None:
+            self._allocated_quantity = sum(line.qty for line in self._allocations)
+        elif CHECK_ALLOCATED_QUANTITY:
+            expected = sum(line.qty for line in self._allocations)
+            assert self._allocated_quantity == expected, (
+                f"batch {self.reference} tracks {self._allocated_quantity} "
+                f"allocated but its lines add up to {expected}"
+            )
+        return self._allocated_quantity
 
     @property
     def available_quantity(self) -> int:
         return self._purchased_quantity - self.allocated_quantity
 
+    def line_for(self, orderid: str) -> Optional[OrderLine]:
+        return next(
+            (line for line in self._allocations if line.orderid == orderid), None
+        )
+
     def can_allocate(self, line: OrderLine) -> bool:
         return self.sku == line.sku and self.available_quantity >= line.qty
 
+    @property
+    def sort_key(self) -> Tuple[bool, date, str]:
+        # in-stock batches first, then shipments by eta; the reference breaks
+        # ties so the order never depends on how the batches were passed in
+        return (self.eta is not None, self.eta or date.min, self.reference)
+
     def __eq__(self, other):
         if not isinstance(other, Batch):
             return False
@@ -46,20 +79,59 @@ class Batch:
         return hash(self.reference)
 
     def __gt__(self, other):
-        if self.eta is None:
-            return False
-        if other.eta is None:
-            return True
-        return self.eta > other.eta
+        return self.sort_key > other.sort_key
 
     def __lt__(self, other):
-        # necessary to keep pycharm happy
-        return not self.__gt__(other)
-
-
-def allocate(line: OrderLine, batches: List[Batch]) -> str:
+        return self.sort_key < other.sort_key
+
+
+class AllocationIndex:
+    """Batches for one SKU, kept in the order allocate() should try them."""
+
+    def __init__(self, batches: Iterable[Batch] = ()):
+        self._batches = sorted(batches, key=lambda b: b.sort_key)
+        self._keys = [b.sort_key for b in self._batches]
+        self._by_reference = {b.reference: b for b in self._batches}
+        self._key_by_reference: Dict[str, Tuple] = {
+            b.reference: key for b, key in zip(self._batches, self._keys)
+        }
+
+    def __iter__(self) -> Iterator[Batch]:
+        return iter(self._batches)
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def get(self, reference: str) -> Optional[Batch]:
+        return self._by_reference.get(reference)
+
+    def add(self, batch: Batch) -> None:
+        key = batch.sort_key
+        i = bisect_right(self._keys, key)
+        self._keys.insert(i, key)
+        self._batches.insert(i, batch)
+        self._by_reference[batch.reference] = batch
+        self._key_by_reference[batch.reference] = key
+
+    def remove(self, batch: Batch) -> None:
+        # look the batch up by the key it was indexed under, which is no longer
+        # its sort_key if its eta has just been changed
+        key = self._key_by_reference.pop(batch.reference)
+        i = bisect_left(self._keys, key)
+        del self._keys[i]
+        del self._batches[i]
+        del self._by_reference[batch.reference]
+
+    def reorder(self, batch: Batch) -> None:
+        self.remove(batch)
+        self.add(batch)
+
+
+def allocate(line: OrderLine, batches: Iterable[Batch]) -> str:
+    if not isinstance(batches, AllocationIndex):
+        batches = sorted(batches, key=lambda b: b.sort_key)
     try:
-        batch = next(b for b in sorted(batches) if b.can_allocate(line))
+        batch = next(b for b in batches if b.can_allocate(line))
     except StopIteration:
         raise OutOfStock(f"Out of stock for sku {line.sku}")
 
@@ -67,5 +139,53 @@ def allocate(line: OrderLine, batches: List[Batch]) -> str:
     return batch.reference
 
 
+class Product:
+    # built from batches on first use, which is also how products loaded by
+    # the ORM get one
+    _allocation_index: Optional[AllocationIndex] = None
+
+    def __init__(self, sku: str, batches: List[Batch], version_number: int = 0):
+        self.sku = sku
+        self.batches = batches
+        self.version_number = version_number
+        self._allocation_index = None
+
+    @property
+    def allocation_index(self) -> AllocationIndex:
+        if self._allocation_index is None:
+            self._allocation_index = AllocationIndex(self.batches)
+        return self._allocation_index
+
+    def add_batch(self, batch: Batch) -> None:
+        self.batches.append(batch)
+        if self._allocation_index is not None:
+            self._allocation_index.add(batch)
+        self.version_number += 1
+
+    def change_batch_eta(self, reference: str, eta: Optional[date]) -> None:
+        batch = self.allocation_index.get(reference)
+        batch.eta = eta
+        self.allocation_index.reorder(batch)
+        self.version_number += 1
+
+    def allocate(self, line: OrderLine) -> str:
+        batchref = allocate(line, self.allocation_index)
+        self.version_number += 1
+        return batchref
+
+    def deallocate(self, reference: str, orderid: str) -> OrderLine:
+        batch = self.allocation_index.get(reference)
+        line = batch.line_for(orderid) if batch is not None else None
+        if line is None:
+            raise NotAllocated(f"Order {orderid} is not allocated to batch {reference}")
+        batch.deallocate(line)
+        self.version_number += 1
+        return line
+
+
 class OutOfStock(Exception):
     pass
+
+
+class NotAllocated(Exception):
+    pass
@@ -0,0 +1,99 @@
+"""Array-backed allocation for what-if planning runs.
+
+VectorisedAllocator replays streams of order lines against a snapshot of
+stock, making the same choices as calling model.allocate line by line:
+each line goes to the first batch, in sort_key order, with enough stock
+left, and a line no batch can take is out of stock and changes nothing.
+The batches themselves are never modified.
+
+Lines are assumed to be distinct, as they are in any real order stream;
+model.allocate would not allocate the same OrderLine twice to one batch.
+"""
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+
+from domain_modelling.domain.model import Batch, OrderLine, OutOfStock
+
+# lines examined per step; grows while whole windows go to the same batch
+_MIN_WINDOW = 64
+
+
+class VectorisedAllocator:
+    def __init__(self, batches: Iterable[Batch]):
+        by_sku: Dict[str, List[Batch]] = {}
+        for batch in sorted(batches, key=lambda b: b.sort_key):
+            by_sku.setdefault(batch.sku, []).append(batch)
+        self._references = {
+            sku: [b.reference for b in batches] for sku, batches in by_sku.items()
+        }
+        self._available = {
+            sku: np.array([b.available_quantity for b in batches], dtype=np.int64)
+            for sku, batches in by_sku.items()
+        }
+
+    def allocate(self, lines: Iterable[OrderLine]) -> List[Union[str, OutOfStock]]:
+        """Allocate lines in order, returning a batchref or OutOfStock for each."""
+        lines = list(lines)
+        positions_by_sku: Dict[str, List[int]] = {}
+        for i, line in enumerate(lines):
+            positions_by_sku.setdefault(line.sku, []).append(i)
+
+        results: List[Union[str, OutOfStock]] = [None] * len(lines)
+        for sku, positions in positions_by_sku.items():
+            qtys = np.fromiter(
+                (lines[i].qty for i in positions), dtype=np.int64, count=len(positions)
+            )
+            references = self._references.get(sku, [])
+            for i, chosen in zip(
+                positions, self.allocate_quantities(sku, qtys).tolist()
+            ):
+                if chosen < 0:
+                    results[i] = OutOfStock(f"Out of stock for sku {sku}")
+                else:
+                    results[i] = references[chosen]
+        return results
+
+    def allocate_quantities(self, sku: str, qtys: np.ndarray) -> np.ndarray:
+        """Allocate a stream of quantities of one SKU.
+
+        Returns, for each quantity, the index of the batch it went to in
+        references(sku), or -1 if it was out of stock.
+        """
+        chosen = np.full(len(qtys), -1, dtype=np.int64)
+        available = self._available.get(sku)
+        if available is None:
+            return chosen
+
+        i, window = 0, _MIN_WINDOW
+        while i < len(qtys):
+            fits = available >= qtys[i]
+            j = int(fits.argmax())
+            if not fits[j]:
+                i += 1
+                continue
+            # the following lines go to batch j too for as long as it has
+            # room and they are too big for every batch ahead of it, none of
+            # which change meanwhile
+            ceiling = available[:j].max() if j else -1
+            segment = qtys[i : i + window]
+            totals = np.cumsum(segment)
+            goes_to_j = (totals <= available[j]) & (segment > ceiling)
+            taken = len(segment) if goes_to_j.all() else int(goes_to_j.argmin())
+            chosen[i : i + taken] = j
+            available[j] -= totals[taken - 1]
+            i += taken
+            window = window * 2 if taken == len(segment) else _MIN_WINDOW
+        return chosen
+
+    def references(self, sku: str) -> List[str]:
+        """The SKU's batch references, in the order allocation prefers them."""
+        return list(self._references.get(sku, []))
+
+    def available_quantities(self) -> Dict[str, int]:
+        """Stock left in each batch, by reference."""
+        return {
+            reference: int(quantity)
+            for sku, references in self._references.items()
+            for reference, quantity in zip(references, self._available[sku])
+        }
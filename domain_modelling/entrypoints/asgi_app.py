@@ -0,0 +1,123 @@
+"""ASGI twin of flask_app: the same /allocate contract, served on asyncio.
+
+Nothing happens at import time: create_app builds the app, and the model
+is mapped and the engine created when the server starts the app up (or,
+under a server that skips the lifespan protocol, on the first request).
+Run it with an ASGI server, e.g.
+
+    uvicorn --factory domain_modelling.entrypoints.asgi_app:create_app --port 5006
+"""
+import json
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from domain_modelling import config
+from domain_modelling.adapters import orm
+from domain_modelling.adapters.async_repository import AsyncSqlAlchemyRepository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+
+
+def default_settings() -> dict:
+    return {
+        "database_uri": config.get_async_postgres_uri(),
+        "engine_options": config.get_pool_settings(),
+    }
+
+
+def create_app(settings: Optional[dict] = None) -> "AllocationApp":
+    """Build the app; settings override any of default_settings()."""
+    return AllocationApp({**default_settings(), **(settings or {})})
+
+
+class AllocationApp:
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.engine = None
+        self.get_session = None
+        self.routes = {
+            ("POST", "/allocate"): self.allocate_endpoint,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if self.engine is None:
+            self._start()
+
+        endpoint = self.routes.get((scope["method"], scope["path"]))
+        if endpoint is None:
+            status, payload = 404, {"message": "Not found"}
+        else:
+            try:
+                body = json.loads(await _read_body(receive))
+            except ValueError:
+                status, payload = 400, {"message": "Request body is not valid JSON"}
+            else:
+                status, payload = await endpoint(body)
+
+        body = json.dumps(payload).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def allocate_endpoint(self, body):
+        try:
+            line = model.OrderLine(body["orderid"], body["sku"], body["qty"])
+        except KeyError as e:
+            return 400, {"message": f"Missing field {e}"}
+        except TypeError:
+            return 400, {"message": "Request body must be a JSON object"}
+
+        async with self.get_session() as session:
+            repo = AsyncSqlAlchemyRepository(session)
+            try:
+                batchref = await services.allocate_async(line, repo, session)
+            except (model.OutOfStock, services.InvalidSku) as e:
+                return 400, {"message": str(e)}
+        return 201, {"batchref": batchref}
+
+    def _start(self):
+        orm.start_mappers()
+        self.engine = create_async_engine(
+            self.settings["database_uri"], **self.settings["engine_options"]
+        )
+        # nothing is read back after the commit, and an expired attribute
+        # can't be lazy-loaded from an async session anyway
+        self.get_session = sessionmaker(
+            bind=self.engine, class_=AsyncSession, expire_on_commit=False
+        )
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if self.engine is None:
+                    self._start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def _read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
@@ -1,18 +1,232 @@
-from flask import Flask, jsonify, request
+"""The allocation HTTP API, built by create_app.
+
+Nothing happens at import time: create_app maps the model (once per
+process) and sets up the app, and the engine is only created when a
+process first needs a connection, so every worker of a forking server gets
+its own pool.  With FLASK_APP pointing at this module, `flask run` finds
+create_app by itself; gunicorn takes it as
+
+    gunicorn "domain_modelling.entrypoints.flask_app:create_app()"
+"""
+import logging
+import os
+import threading
+from typing import Optional
+
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, request
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from domain_modelling import config, model, orm, repository, services
+from domain_modelling import config, instrumentation, views
+from domain_modelling.adapters import orm, pool, repository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+from domain_modelling.service_layer.coordinator import AllocationCoordinator
+from domain_modelling.service_layer.partitioned import PartitionedAllocator
+from domain_modelling.service_layer.unit_of_work import session_scope
+
+api = Blueprint("allocation", __name__)
+
+
+def default_settings() -> dict:
+    return {
+        "database_uri": config.get_postgres_uri(),
+        "engine_options": dict(
+            poolclass=pool.MeteredQueuePool, **config.get_pool_settings()
+        ),
+        "product_cache_size": config.get_product_cache_size(),
+        "metrics_sink": config.get_metrics_sink(),
+        "loading_strategy": config.get_loading_strategy(),
+        "allocation_coalescing": config.get_allocation_coalescing(),
+        "allocation_partitions": config.get_allocation_partitions(),
+        "warm_up": config.get_warm_up(),
+    }
+
+
+def create_app(settings: Optional[dict] = None) -> Flask:
+    """Build the app; settings override any of default_settings().
+
+    With warm_up set, the pool's connections are opened and the hot
+    statements compiled before this returns.  Under a server that imports
+    the app before forking its workers, leave it off and call warm_up from
+    the server's post-fork hook instead.
+    """
+    settings = {**default_settings(), **(settings or {})}
+    orm.start_mappers()
+
+    metrics = None
+    if settings["metrics_sink"] == "prometheus":
+        metrics = instrumentation.MetricsRegistry()
+        instrumentation.configure(metrics)
+    elif settings["metrics_sink"] == "log":
+        instrumentation.configure(
+            instrumentation.LogSink(logging.getLogger("domain_modelling.metrics"))
+        )
+
+    product_cache = None
+    if settings["product_cache_size"]:
+        product_cache = repository.ProductCache(settings["product_cache_size"])
+    database = Database(
+        settings["database_uri"],
+        settings["engine_options"],
+        # cached products are reused after their session commits, so they
+        # must keep their loaded state instead of being expired
+        expire_on_commit=product_cache is None,
+    )
+    state = AllocationState(
+        database,
+        product_cache,
+        metrics,
+        settings["loading_strategy"],
+        settings["allocation_partitions"],
+    )
+    if settings["allocation_coalescing"]["window"] > 0:
+        state.coordinator = AllocationCoordinator(
+            database.get_session,
+            state.make_repository,
+            **settings["allocation_coalescing"],
+        )
+
+    app = Flask(__name__)
+    app.extensions["allocation"] = state
+    app.register_blueprint(api)
+    if settings["warm_up"]:
+        warm_up(app)
+    return app
+
+
+def warm_up(app: Flask) -> None:
+    """Fill this process's pool and compile the statements requests run."""
+    state = app.extensions["allocation"]
+    engine = state.database.engine
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    connections = [engine.connect() for _ in range(size)]
+    for connection in connections:
+        connection.close()
+
+    # compiled statements are cached per engine, so running each query once
+    # is enough, even if it finds nothing
+    with session_scope(state.database.get_session) as session:
+        repo = state.make_repository(session)
+        repo.get_version("")
+        repo.get_product("")
+        repo.get_allocated_batch("", "")
+        views.available_stock("", session)
+
+
+class Database:
+    """An engine and its sessions, created afresh in each process.
+
+    A pool copied into a forked child would share its sockets with the
+    parent, so the first use in a new process discards it, without closing
+    the parent's connections, and starts another.
+    """
+
+    def __init__(self, uri: str, engine_options: dict, expire_on_commit: bool):
+        self.uri = uri
+        self.engine_options = engine_options
+        self.expire_on_commit = expire_on_commit
+        self._engine = None
+        self._sessionmaker = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._connect()
+        return self._engine
+
+    def get_session(self):
+        self.engine  # pylint: disable=pointless-statement
+        return self._sessionmaker()
+
+    def _connect(self):
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+        engine = create_engine(self.uri, **self.engine_options)
+        if instrumentation.enabled():
+            instrumentation.instrument_engine(engine)
+        self._sessionmaker = sessionmaker(
+            bind=engine, expire_on_commit=self.expire_on_commit
+        )
+        self._engine, self._pid = engine, os.getpid()
+
+
+class AllocationState:
+    """Everything the views share, kept in app.extensions["allocation"]."""
+
+    def __init__(
+        self, database, product_cache, metrics, loading_strategy, partitions=0
+    ):
+        self.database = database
+        self.product_cache = product_cache
+        self.metrics = metrics
+        self.loading_strategy = loading_strategy
+        self.partitions = partitions
+        self.coordinator = None
+        self._allocator = None
+        self._allocator_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def allocator(self) -> Optional[PartitionedAllocator]:
+        """This process's PartitionedAllocator, if allocation is partitioned.
 
-orm.start_mappers()
-get_session = sessionmaker(bind=create_engine(config.get_postgres_uri()))
-app = Flask(__name__)
+        Like the engine, it is started on first use in each process: the
+        worker processes and dispatcher thread of one built before a fork
+        belong to the parent.
+        """
+        if not self.partitions:
+            return None
+        if self._allocator_pid != os.getpid():
+            with self._lock:
+                if self._allocator_pid != os.getpid():
+                    self._allocator = PartitionedAllocator(
+                        self.database.uri,
+                        workers=self.partitions,
+                        engine_options=self.database.engine_options,
+                    )
+                    self._allocator_pid = os.getpid()
+        return self._allocator
 
+    def make_repository(self, session):
+        repo = repository.SqlAlchemyRepository(session, self.loading_strategy)
+        if self.product_cache is not None:
+            return repository.CachingRepository(repo, self.product_cache)
+        return repo
 
-@app.route("/allocate", methods=["POST"])
+
+def _state() -> AllocationState:
+    return current_app.extensions["allocation"]
+
+
+@api.before_app_request
+def start_request_metrics():
+    g.request_metrics = instrumentation.start_request()
+
+
+@api.after_app_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@api.teardown_app_request
+def finish_request_metrics(_):
+    # teardown runs even when a view raises, which after_request does not,
+    # so the request's SQL counter is always released
+    if g.get("request_metrics") is not None:
+        g.request_metrics.finish(
+            endpoint=request.endpoint, status=g.get("response_status", 500)
+        )
+
+
+@api.route("/allocate", methods=["POST"])
 def allocate_endpoint():
-    session = get_session()
-    batches = repository.SqlAlchemyRepository(session)
+    state = _state()
     line = model.OrderLine(
         request.json["orderid"],
         request.json["sku"],
@@ -20,7 +234,107 @@ def allocate_endpoint():
     )
 
     try:
-        batchref = services.allocate(line, batches, session)
+        if state.allocator is not None:
+            batchref = state.allocator.allocate(line)
+        elif state.coordinator is not None:
+            batchref = state.coordinator.allocate(line)
+        else:
+            with session_scope(state.database.get_session) as session:
+                repo = state.make_repository(session)
+                batchref = services.allocate(line, repo, session)
     except (model.OutOfStock, services.InvalidSku) as e:
         return jsonify({"message": str(e)}), 400
     return jsonify({"batchref": batchref}), 201
+
+
+@api.route("/allocate/bulk", methods=["POST"])
+def allocate_bulk_endpoint():
+    state = _state()
+    lines = [
+        model.OrderLine(line["orderid"], line["sku"], line["qty"])
+        for line in request.json["lines"]
+    ]
+
+    with session_scope(state.database.get_session) as session:
+        repo = state.make_repository(session)
+        allocated = services.allocate_many(lines, repo, session)
+
+    # the lines expired when the session committed; reading them again
+    # would mean a query each, or fail once the session has closed
+    results = []
+    for line, result in zip(request.json["lines"], allocated):
+        entry = {"orderid": line["orderid"], "sku": line["sku"]}
+        if isinstance(result, Exception):
+            entry["message"] = str(result)
+        else:
+            entry["batchref"] = result
+        results.append(entry)
+    allocated_any = any("batchref" in r for r in results)
+    return jsonify({"results": results}), 201 if allocated_any else 400
+
+
+@api.route("/deallocate", methods=["POST"])
+def deallocate_endpoint():
+    state = _state()
+    with session_scope(state.database.get_session) as session:
+        repo = state.make_repository(session)
+        try:
+            batchref = services.deallocate(
+                request.json["orderid"], request.json["sku"], repo, session
+            )
+        except model.NotAllocated as e:
+            return jsonify({"message": str(e)}), 400
+    return jsonify({"batchref": batchref}), 200
+
+
+@api.route("/reallocate", methods=["POST"])
+def reallocate_endpoint():
+    state = _state()
+    with session_scope(state.database.get_session) as session:
+        repo = state.make_repository(session)
+        try:
+            batchref = services.reallocate(
+                request.json["orderid"], request.json["sku"], repo, session
+            )
+        except (model.OutOfStock, model.NotAllocated) as e:
+            return jsonify({"message": str(e)}), 400
+    return jsonify({"batchref": batchref}), 201
+
+
+@api.route("/stock/<sku>", methods=["GET"])
+def stock_endpoint(sku):
+    with session_scope(_state().database.get_session) as session:
+        stock = views.available_stock(sku, session)
+    if not stock:
+        return jsonify({"message": f"Invalid sku {sku}"}), 404
+    return (
+        jsonify(
+            {
+                "sku": sku,
+                "available": sum(batch["available"] for batch in stock),
+                "batches": stock,
+            }
+        ),
+        200,
+    )
+
+
+@api.route("/metrics/pool", methods=["GET"])
+def pool_metrics_endpoint():
+    return jsonify(_state().database.engine.pool.stats()), 200
+
+
+@api.route("/metrics/cache", methods=["GET"])
+def cache_metrics_endpoint():
+    product_cache = _state().product_cache
+    if product_cache is None:
+        return jsonify({"message": "Product cache is disabled"}), 404
+    return jsonify(product_cache.stats()), 200
+
+
+@api.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    metrics = _state().metrics
+    if metrics is None:
+        return jsonify({"message": "Prometheus metrics are disabled"}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
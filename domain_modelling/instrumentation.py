@@ -0,0 +1,237 @@
+"""Timers, counters and histograms around the allocation hot path.
+
+Nothing is recorded until configure() is given a sink; until then timer()
+hands back a shared no-op context manager and increment()/observe() return
+straight away, so instrumented code pays for one global lookup.
+
+A sink has two methods, increment(name, amount, labels) and
+observe(name, value, labels).  MetricsRegistry aggregates in memory and
+renders the Prometheus text format; LogSink logs every observation.
+"""
+import contextlib
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+# upper bounds, in seconds, of the timing histogram buckets
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# upper bounds of the SQL-statements-per-request histogram buckets
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+_sink = None
+_NULL_TIMER = contextlib.nullcontext()
+_request_sql = contextvars.ContextVar("request_sql", default=None)
+
+
+def configure(sink):
+    """Send metrics to sink from now on; None turns instrumentation off."""
+    global _sink
+    _sink = sink
+
+
+def enabled():
+    return _sink is not None
+
+
+def increment(name, amount=1, **labels):
+    if _sink is not None:
+        _sink.increment(name, amount, labels)
+
+
+def observe(name, value, **labels):
+    if _sink is not None:
+        _sink.observe(name, value, labels)
+
+
+def timer(name, **labels):
+    """Context manager observing how long its block took, in seconds."""
+    if _sink is None:
+        return _NULL_TIMER
+    return _Timer(_sink, name, labels)
+
+
+def timed(name, **labels):
+    """Decorator form of timer()."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if _sink is None:
+                    return await fn(*args, **kwargs)
+                with _Timer(_sink, name, labels):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return fn(*args, **kwargs)
+            with _Timer(_sink, name, labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class _Timer:
+    __slots__ = ("sink", "name", "labels", "start")
+
+    def __init__(self, sink, name, labels):
+        self.sink = sink
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.sink.observe(self.name, time.perf_counter() - self.start, self.labels)
+
+
+class RequestMetrics:
+    """Times one request and counts the SQL statements it runs.
+
+    Statements are only counted on engines passed to instrument_engine.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self._token = _request_sql.set(self)
+
+    def finish(self, **labels):
+        _request_sql.reset(self._token)
+        observe("http_request_seconds", time.perf_counter() - self.start, **labels)
+        observe("sql_statements_per_request", self.statements, **labels)
+        observe("sql_seconds_per_request", self.sql_seconds, **labels)
+
+
+def start_request():
+    """A RequestMetrics for the current request, or None when turned off."""
+    if _sink is None:
+        return None
+    return RequestMetrics()
+
+
+def instrument_engine(engine):
+    """Time every statement engine runs, and count it against the request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        observe("sql_statement_seconds", elapsed)
+        request = _request_sql.get()
+        if request is not None:
+            request.statements += 1
+            request.sql_seconds += elapsed
+
+
+class MetricsRegistry:
+    """In-memory sink that renders the Prometheus text exposition format.
+
+    Histograms named in count_histograms use COUNT_BUCKETS, the rest
+    TIME_BUCKETS.
+    """
+
+    count_histograms = frozenset({"sql_statements_per_request"})
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, amount, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels):
+        key = (name, _label_key(labels))
+        buckets = COUNT_BUCKETS if name in self.count_histograms else TIME_BUCKETS
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, series in _by_name(self._counters):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name, series in _by_name(self._histograms):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series:
+                    lines.extend(histogram.render(name, labels))
+        return "\n".join(lines) + "\n"
+
+
+class _Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        cumulative = 0
+        for bound, count in zip([*self.bounds, "+Inf"], self.counts):
+            cumulative += count
+            bucket_labels = labels + (("le", str(bound)),)
+            yield f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+        yield f"{name}_sum{_format_labels(labels)} {self.sum}"
+        yield f"{name}_count{_format_labels(labels)} {cumulative}"
+
+
+class LogSink:
+    """Sink that logs each counter increment and observation as it happens."""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def increment(self, name, amount, labels):
+        self.logger.info("%s%s +%s", name, _format_labels(_label_key(labels)), amount)
+
+    def observe(self, name, value, labels):
+        self.logger.info("%s%s %.6f", name, _format_labels(_label_key(labels)), value)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _by_name(series):
+    by_name = {}
+    for (name, labels), value in sorted(series.items(), key=lambda item: item[0]):
+        by_name.setdefault(name, []).append((labels, value))
+    return by_name.items()
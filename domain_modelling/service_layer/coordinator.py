@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List
+
+from domain_modelling.adapters import repository
+from domain_modelling.domain.model import OrderLine
+from domain_modelling.service_layer import services
+from domain_modelling.service_layer.unit_of_work import session_scope
+
+
+class _Request:
+    __slots__ = ("line", "done", "result", "error", "leads")
+
+    def __init__(self, line: OrderLine):
+        self.line = line
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.leads = False
+
+
+class AllocationCoordinator:
+    """Coalesces concurrent allocations for the same SKU into one transaction.
+
+    The first caller for a SKU becomes its leader: it waits up to `window`
+    seconds for up to `max_group` requests in total to queue up behind it,
+    allocates them all in arrival order with services.allocate_many, and
+    commits once.  Each caller gets back its own batchref, or has its own
+    OutOfStock/InvalidSku raised, exactly as if the lines had been allocated
+    one at a time in that order.  If more requests arrived meanwhile, the
+    oldest of them leads the next group.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable,
+        make_repository: Callable = repository.SqlAlchemyRepository,
+        window: float = 0.002,
+        max_group: int = 100,
+    ):
+        self.session_factory = session_factory
+        self.make_repository = make_repository
+        self.window = window
+        self.max_group = max_group
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+        # a SKU has a queue exactly while some thread is leading it
+        self._queues: Dict[str, Deque[_Request]] = {}
+
+    def allocate(self, line: OrderLine) -> str:
+        request = _Request(line)
+        with self._lock:
+            queue = self._queues.get(line.sku)
+            if queue is None:
+                queue = self._queues[line.sku] = deque()
+                request.leads = True
+            else:
+                self._arrived.notify_all()
+            queue.append(request)
+
+        if not request.leads:
+            request.done.wait()
+        if request.leads:
+            self._lead(line.sku, queue)
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _lead(self, sku: str, queue: Deque[_Request]) -> None:
+        deadline = time.monotonic() + self.window
+        with self._lock:
+            while len(queue) < self.max_group:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._arrived.wait(remaining)
+            group = [queue.popleft() for _ in range(min(self.max_group, len(queue)))]
+
+        self._allocate_group(group)
+
+        with self._lock:
+            if queue:
+                queue[0].leads = True
+                queue[0].done.set()
+            else:
+                del self._queues[sku]
+        for request in group:
+            request.done.set()
+
+    def _allocate_group(self, group: List[_Request]) -> None:
+        try:
+            with session_scope(self.session_factory) as session:
+                results = services.allocate_many(
+                    [request.line for request in group],
+                    self.make_repository(session),
+                    session,
+                )
+        except Exception as e:  # pylint: disable=broad-except
+            for request in group:
+                request.error = e
+            return
+        for request, result in zip(group, results):
+            if isinstance(result, Exception):
+                request.error = result
+            else:
+                request.result = result
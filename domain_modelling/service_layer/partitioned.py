@@ -0,0 +1,347 @@
+"""Allocation spread over worker processes, each owning a share of the SKUs.
+
+Every SKU belongs to exactly one worker, picked by a stable hash of the SKU,
+so workers never contend for a product and each can keep the products it
+owns loaded and allocate against them in memory.  Persistence goes through
+SqlAlchemyRepository as usual, but commits are grouped: a worker allocates
+each request as it arrives and commits once its queue runs dry, it has
+flush_size allocations waiting or the oldest has waited flush_interval
+seconds, whichever comes first.
+
+Replies are held back until the commit covering them succeeds, so an
+allocation that has been answered is never lost.  If a commit fails, for
+instance because add_batches or another process changed one of the
+worker's products, the worker reloads its products and allocates the held
+lines again, up to services.MAX_ALLOCATION_ATTEMPTS times, before replying
+with whatever that gives.
+
+Deallocations, reallocations and stock feeds don't go through the workers,
+and stock they free never makes a commit fail.  So before answering
+OutOfStock from a product it has kept loaded, a worker checks the
+product's version_number in the database and reloads it if it has moved.
+
+Any other error goes back to the caller too.  A worker that dies anyway
+fails the calls waiting on it with WorkerDied, and any made to it later.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from domain_modelling.adapters import orm, repository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+
+logger = logging.getLogger(__name__)
+
+# how often the front end checks that its workers are still running
+LIVENESS_INTERVAL = 0.5
+
+
+class WorkerDied(Exception):
+    pass
+
+
+def worker_for(sku: str, workers: int) -> int:
+    # not hash(), which is salted differently in every process
+    return zlib.crc32(sku.encode()) % workers
+
+
+class PartitionedAllocator:
+    def __init__(
+        self,
+        database_uri: str,
+        workers: Optional[int] = None,
+        flush_interval: float = 0.05,
+        flush_size: int = 500,
+        start_method: Optional[str] = None,
+        engine_options: Optional[dict] = None,
+    ):
+        context = multiprocessing.get_context(start_method)
+        self._responses = context.Queue()
+        self._requests = []
+        self._processes = []
+        for _ in range(workers or os.cpu_count() or 1):
+            requests = context.Queue()
+            process = context.Process(
+                target=_worker_main,
+                args=(database_uri, engine_options or {}, requests, self._responses)
+                + (flush_interval, flush_size),
+                daemon=True,
+            )
+            process.start()
+            self._requests.append(requests)
+            self._processes.append(process)
+
+        self._ids = itertools.count()
+        self._pending: Dict[int, Tuple[int, Future]] = {}
+        self._lock = threading.Lock()
+        self._closing = False
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def allocate(self, line: model.OrderLine) -> str:
+        """Allocate line on the worker that owns its SKU.
+
+        Raises OutOfStock or InvalidSku just as services.allocate does.
+        """
+        worker = worker_for(line.sku, len(self._requests))
+        return self._call(worker, ("allocate", line.orderid, line.sku, line.qty))
+
+    def flush(self) -> None:
+        """Wait until every worker has committed what it has allocated."""
+        for worker in range(len(self._requests)):
+            self._call(worker, ("flush",))
+
+    def close(self) -> None:
+        """Flush and stop the workers."""
+        self._closing = True
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join()
+        self._responses.put(None)
+        self._dispatcher.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _call(self, worker, message):
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = worker, future
+        if not self._processes[worker].is_alive():
+            self._fail_pending(worker)
+        else:
+            self._requests[worker].put((request_id, *message))
+        return future.result()
+
+    def _dispatch(self):
+        next_check = time.monotonic() + LIVENESS_INTERVAL
+        while True:
+            try:
+                response = self._responses.get(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                pass
+            else:
+                if response is None:
+                    return
+                self._resolve(*response)
+            if time.monotonic() >= next_check and not self._closing:
+                self._check_workers()
+                next_check = time.monotonic() + LIVENESS_INTERVAL
+
+    def _resolve(self, request_id, result, error):
+        with self._lock:
+            _, future = self._pending.pop(request_id)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _check_workers(self):
+        dead = [
+            w for w, process in enumerate(self._processes) if not process.is_alive()
+        ]
+        if not dead:
+            return
+        # a worker's last replies are in the queue before it has exited
+        while True:
+            try:
+                response = self._responses.get_nowait()
+            except queue.Empty:
+                break
+            if response is None:
+                # close() got there first; leave it for _dispatch
+                self._responses.put(None)
+                break
+            self._resolve(*response)
+        for worker in dead:
+            self._fail_pending(worker)
+
+    def _fail_pending(self, worker):
+        exitcode = self._processes[worker].exitcode
+        with self._lock:
+            failed = [
+                request_id
+                for request_id, (owner, _) in self._pending.items()
+                if owner == worker
+            ]
+            futures = [self._pending.pop(request_id)[1] for request_id in failed]
+        for future in futures:
+            future.set_exception(
+                WorkerDied(f"worker {worker} exited with code {exitcode}")
+            )
+
+
+def _worker_main(
+    database_uri, engine_options, requests, responses, flush_interval, flush_size
+):
+    # the engine, and its connections, must belong to this process
+    orm.start_mappers()
+    engine = create_engine(database_uri, **engine_options)
+    # products stay loaded across commits, so they mustn't expire on them
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    worker = _Worker(session)
+    deadline = None
+    while True:
+        if worker.held and (
+            requests.empty()
+            or len(worker.held) >= flush_size
+            or time.monotonic() >= deadline
+        ):
+            _reply(responses, worker.commit())
+            deadline = None
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            message = requests.get(timeout=timeout)
+        except queue.Empty:
+            continue
+        if message is None:
+            _reply(responses, worker.commit())
+            session.close()
+            engine.dispose()
+            return
+
+        request_id, command, *args = message
+        if command == "allocate":
+            worker.allocate(request_id, *args)
+            deadline = deadline or time.monotonic() + flush_interval
+        elif command == "flush":
+            _reply(responses, worker.commit())
+            responses.put((request_id, None, None))
+
+
+def _reply(responses, replies):
+    for request_id, result, error in replies:
+        responses.put((request_id, result, _picklable(error)))
+
+
+def _picklable(error):
+    # the queue pickles in a background thread, where a failure would only
+    # be logged and leave the caller waiting for ever
+    if error is None:
+        return None
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:  # pylint: disable=broad-except
+        return RuntimeError(repr(error))
+
+
+class _Allocation:
+    __slots__ = ("request_id", "line", "result", "error")
+
+    def __init__(self, request_id: int, line: model.OrderLine):
+        self.request_id = request_id
+        self.line = line
+        self.result = None
+        self.error = None
+
+
+class _Worker:
+    def __init__(self, session):
+        self.session = session
+        self.repo = repository.SqlAlchemyRepository(session)
+        self.products: Dict[str, Optional[model.Product]] = {}
+        # allocated since the last commit, waiting on it for their replies
+        self.held: List[_Allocation] = []
+        # SKUs whose products those allocations changed
+        self.changed: Set[str] = set()
+
+    def allocate(self, request_id, orderid, sku, qty):
+        allocation = _Allocation(request_id, model.OrderLine(orderid, sku, qty))
+        self._apply(allocation)
+        self.held.append(allocation)
+
+    def commit(self):
+        """Commit the held allocations and return their replies.
+
+        None of them has been answered yet, so after a failed commit they
+        can simply be allocated again against freshly loaded products.
+        """
+        for attempt in range(1, services.MAX_ALLOCATION_ATTEMPTS + 1):
+            try:
+                self.session.commit()
+                break
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(
+                    "commit of %d allocations failed; reloading products",
+                    len(self.held),
+                    exc_info=True,
+                )
+                self._reset()
+                for allocation in self.held:
+                    if attempt == services.MAX_ALLOCATION_ATTEMPTS:
+                        allocation.result, allocation.error = None, e
+                    else:
+                        self._apply(allocation)
+        replies = [(a.request_id, a.result, a.error) for a in self.held]
+        self.held = []
+        self.changed.clear()
+        return replies
+
+    def _apply(self, allocation):
+        try:
+            allocation.result = self._allocate(allocation.line)
+            allocation.error = None
+        except Exception as e:  # pylint: disable=broad-except
+            # the caller gets the error, whatever it is; the worker carries on
+            allocation.result, allocation.error = None, e
+
+    def _allocate(self, line):
+        product = self._product(line.sku)
+        try:
+            batchref = product.allocate(line)
+        except model.OutOfStock:
+            # a changed product will fail the commit and be reloaded then;
+            # an unchanged one may be out of date, if stock was freed or
+            # added behind the worker's back
+            if (
+                line.sku in self.changed
+                or self.repo.get_version(line.sku) == product.version_number
+            ):
+                raise
+            self._forget(line.sku)
+            batchref = self._product(line.sku).allocate(line)
+        self.changed.add(line.sku)
+        return batchref
+
+    def _product(self, sku):
+        if sku not in self.products:
+            self.products[sku] = self.repo.get_product(sku)
+        product = self.products[sku]
+        if product is None or not services.is_valid_sku(sku, product.batches):
+            # forget it, in case its stock turns up later
+            del self.products[sku]
+            raise services.InvalidSku(f"Invalid sku {sku}")
+        return product
+
+    def _forget(self, sku):
+        # nothing of it is waiting to be committed, so it can simply go
+        product = self.products.pop(sku)
+        for batch in product.batches:
+            for line in batch._allocations:
+                self.session.expunge(line)
+            self.session.expunge(batch)
+        self.session.expunge(product)
+
+    def _reset(self):
+        self.session.rollback()
+        self.session.expunge_all()
+        self.products.clear()
+        self.changed.clear()
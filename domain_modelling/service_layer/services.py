@@ -1,9 +1,22 @@
 from __future__ import annotations
 
-from domain_modelling.adapters.repository import AbstractRepository
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Union
+
+from sqlalchemy.orm.exc import StaleDataError
+
+from domain_modelling import instrumentation
+from domain_modelling.adapters import batch_loader
+from domain_modelling.adapters.repository import (
+    AbstractAsyncRepository,
+    AbstractRepository,
+)
 from domain_modelling.domain import model
 from domain_modelling.domain.model import Batch, OrderLine
 
+MAX_ALLOCATION_ATTEMPTS = 3
+ADD_BATCHES_CHUNK_SIZE = 10_000
+
 
 class InvalidSku(Exception):
     pass
@@ -13,11 +26,150 @@ def is_valid_sku(sku, batches):
     return sku in {b.sku for b in batches}
 
 
+@instrumentation.timed("service_seconds", operation="allocate")
 def allocate(line: OrderLine, repo: AbstractRepository, session) -> str:
-    batches = repo.list()
+    def allocate_line():
+        product = repo.get_product(line.sku)
+        if product is None or not is_valid_sku(line.sku, product.batches):
+            raise InvalidSku(f"Invalid sku {line.sku}")
+        with instrumentation.timer("domain_seconds", operation="allocate"):
+            return product.allocate(line)
+
+    return _commit_retrying_conflicts(allocate_line, session)
+
+
+@instrumentation.timed("service_seconds", operation="allocate_many")
+def allocate_many(
+    lines: List[OrderLine], repo: AbstractRepository, session
+) -> List[Union[str, Exception]]:
+    """Allocate every line in one transaction.
+
+    Returns one entry per line, in order: the batchref it was allocated to, or
+    the InvalidSku/OutOfStock error that stopped it.  Failed lines don't stop
+    the others from being allocated.
+    """
+
+    def allocate_lines():
+        products: Dict[str, Optional[model.Product]] = {}
+        results: List[Union[str, Exception]] = []
+        for line in lines:
+            if line.sku not in products:
+                products[line.sku] = repo.get_product(line.sku)
+            product = products[line.sku]
+            if product is None or not is_valid_sku(line.sku, product.batches):
+                results.append(InvalidSku(f"Invalid sku {line.sku}"))
+                continue
+            try:
+                results.append(product.allocate(line))
+            except model.OutOfStock as e:
+                results.append(e)
+        return results
+
+    return _commit_retrying_conflicts(allocate_lines, session)
+
+
+@instrumentation.timed("service_seconds", operation="deallocate")
+def deallocate(orderid: str, sku: str, repo: AbstractRepository, session) -> str:
+    def deallocate_line():
+        batch = _get_allocated_batch(orderid, sku, repo)
+        product = repo.get_product(sku)
+        product.deallocate(batch.reference, orderid)
+        return batch.reference
+
+    return _commit_retrying_conflicts(deallocate_line, session)
+
+
+@instrumentation.timed("service_seconds", operation="reallocate")
+def reallocate(orderid: str, sku: str, repo: AbstractRepository, session) -> str:
+    def reallocate_line():
+        batch = _get_allocated_batch(orderid, sku, repo)
+        product = repo.get_product(sku)
+        line = product.deallocate(batch.reference, orderid)
+        return product.allocate(line)
+
+    return _commit_retrying_conflicts(reallocate_line, session)
+
+
+@instrumentation.timed("service_seconds", operation="add_batches")
+def add_batches(
+    rows: Iterable[dict], session, chunk_size: int = ADD_BATCHES_CHUNK_SIZE
+) -> int:
+    """Upsert batches from a stream of rows, e.g. from adapters.stock_feed.
+
+    Rows are dicts with reference, sku, qty and eta.  They are written
+    chunk_size at a time with set-based statements (COPY on Postgres), and
+    each chunk is committed before the next is read, so memory use doesn't
+    depend on the size of the feed.  Missing products are created; batches
+    whose reference already exists get the new quantity and eta.  Returns
+    the number of rows read.
+    """
+    rows = iter(rows)
+    count = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return count
+        # later rows for the same reference win, as they would row by row
+        unique = list({row["reference"]: row for row in chunk}.values())
+        batch_loader.load_batches(session, unique)
+        session.commit()
+        count += len(chunk)
+
+
+def _get_allocated_batch(orderid, sku, repo):
+    batch = repo.get_allocated_batch(orderid, sku)
+    if batch is None:
+        raise model.NotAllocated(f"Order {orderid} has no allocation for sku {sku}")
+    return batch
+
+
+def _commit_retrying_conflicts(work, session):
+    # another worker allocating against the same product makes our commit
+    # fail on its version_number check; reload and try again
+    for attempt in range(1, MAX_ALLOCATION_ATTEMPTS + 1):
+        result = work()
+        try:
+            with instrumentation.timer("commit_seconds"):
+                session.commit()
+        except StaleDataError as e:
+            session.rollback()
+            _conflicted(e, attempt)
+        else:
+            return result
+
+
+async def _commit_retrying_conflicts_async(work, session):
+    # _commit_retrying_conflicts for an AsyncSession; work is a coroutine
+    # function
+    for attempt in range(1, MAX_ALLOCATION_ATTEMPTS + 1):
+        result = await work()
+        try:
+            with instrumentation.timer("commit_seconds"):
+                await session.commit()
+        except StaleDataError as e:
+            await session.rollback()
+            _conflicted(e, attempt)
+        else:
+            return result
+
+
+def _conflicted(error, attempt):
+    instrumentation.increment("commit_conflicts_total")
+    if attempt == MAX_ALLOCATION_ATTEMPTS:
+        raise error
+
+
+@instrumentation.timed("service_seconds", operation="allocate")
+async def allocate_async(
+    line: OrderLine, repo: AbstractAsyncRepository, session
+) -> str:
+    """services.allocate for an AbstractAsyncRepository and AsyncSession."""
+
+    async def allocate_line():
+        product = await repo.get_product(line.sku)
+        if product is None or not is_valid_sku(line.sku, product.batches):
+            raise InvalidSku(f"Invalid sku {line.sku}")
+        with instrumentation.timer("domain_seconds", operation="allocate"):
+            return product.allocate(line)
 
-    if not is_valid_sku(line.sku, batches):
-        raise InvalidSku(f"Invalid sku {line.sku}")
-    batchref = model.allocate(line, batches)
-    session.commit()
-    return batchref
+    return await _commit_retrying_conflicts_async(allocate_line, session)
@@ -0,0 +1,19 @@
+from contextlib import contextmanager
+
+
+@contextmanager
+def session_scope(session_factory):
+    """Hand out a session for one unit of work.
+
+    The services commit what they want kept; anything else is rolled back,
+    and the session is always closed so its connection goes straight back to
+    the pool instead of waiting for the garbage collector.
+    """
+    session = session_factory()
+    try:
+        yield session
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -1,21 +1,80 @@
+import errno
+import functools
 import hashlib
+import mmap
 import os
 import shutil
+import sqlite3
+import tempfile
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
+from time import sleep
 
 BLOCKSIZE = 65536
+# below this, mapping and unmapping a file costs more than reading it
+# (see benchmarks/bench_hashing.py)
+MMAP_THRESHOLD = 1024 * 1024
+# hashlib releases the GIL while it hashes, so threads overlap both the disk
+# reads and the hashing itself
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+# copies to network mounts are latency-bound, so keep plenty of them in flight
+ACTION_WORKERS = 16
+TRANSIENT_ERRNOS = frozenset(
+    {errno.EAGAIN, errno.EBUSY, errno.EINTR, errno.EIO, errno.ETIMEDOUT}
+)
 
 
-def hash_file(path):
-    hasher = hashlib.sha1()
-    with path.open("rb") as file:
-        buf = file.read(BLOCKSIZE)
-        while buf:
-            hasher.update(buf)
-            buf = file.read(BLOCKSIZE)
+def hash_file(path, blocksize=BLOCKSIZE, backend=None):
+    """SHA-1 of a file's contents, as a hex string.
+
+    backend is one of HASH_BACKENDS; by default files of MMAP_THRESHOLD
+    bytes or more are memory-mapped and smaller ones read into a reused
+    buffer.
+    """
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if backend is None:
+            backend = "mmap" if size >= MMAP_THRESHOLD else "readinto"
+        hasher = hashlib.sha1()
+        HASH_BACKENDS[backend](hasher, file, size, blocksize)
     return hasher.hexdigest()
 
 
+def _hash_read(hasher, file, size, blocksize):
+    buf = file.read(blocksize)
+    while buf:
+        hasher.update(buf)
+        buf = file.read(blocksize)
+
+
+def _hash_readinto(hasher, file, size, blocksize):
+    buf = bytearray(max(min(blocksize, size), 1))
+    view = memoryview(buf)
+    n = file.readinto(buf)
+    while n:
+        hasher.update(view[:n])
+        n = file.readinto(buf)
+
+
+def _hash_mmap(hasher, file, size, blocksize):
+    if not size:
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            for offset in range(0, len(mapped), blocksize):
+                hasher.update(view[offset : offset + blocksize])
+        finally:
+            view.release()
+
+
+HASH_BACKENDS = {"read": _hash_read, "readinto": _hash_readinto, "mmap": _hash_mmap}
+
+
 def sync_old(source, dest):
     # walk the source folder and build a dict of hashes and filenames
     source_hashes = {}
@@ -47,10 +106,32 @@ def sync_old(source, dest):
             shutil.copy(Path(source) / filename, Path(dest) / filename)
 
 
-def sync(reader, filesystem, source, dst):
+def sync(
+    source, dst, reader=None, filesystem=None, executor=None, tiered=False, cache=None
+):
+    """Make dst a copy of source.
+
+    tiered=True compares the trees with read_tiered_hashes instead of
+    reader.  cache, a HashCache, is used by the default reader and
+    filesystem and by the tiered comparison.
+    """
+    if reader is None:
+        reader = functools.partial(read_paths_and_hashes, cache=cache)
+    if filesystem is None:
+        filesystem = LocalFileSystem(cache)
+
     # imperative shell step 1, gather inputs
-    source_hashes = reader(source)
-    dst_hashes = reader(dst)
+    if tiered:
+        source_hashes, dst_hashes = read_tiered_hashes(source, dst, cache)
+    else:
+        source_hashes = reader(source)
+        dst_hashes = reader(dst)
+
+    if executor is not None:
+        executor.run(
+            filesystem, determine_actions(source_hashes, dst_hashes, source, dst)
+        )
+        return
 
     for sha, filename in source_hashes.items():
         if sha not in dst_hashes:
@@ -65,14 +146,353 @@ def sync(reader, filesystem, source, dst):
             filesystem.delete(Path(dst, filename))
 
 
-def read_paths_and_hashes(path):
+class LocalFileSystem:
+    """The filesystem sync acts on, copying inside the kernel where it can.
+
+    A copy tries a reflink (FICLONE) first, then os.copy_file_range, then
+    os.sendfile.  None of those bring the data into userspace.  Without a
+    hash cache they are always tried first.  With one, they are only used
+    when the source's SHA-1 is already in it - which it will be if the same
+    cache was used to decide what to copy - and the destination is recorded
+    under that SHA-1 without being read.  Otherwise the file is copied
+    through a buffer and hashed on the way, so the cache is still warm
+    after a single read.
+    """
+
+    def __init__(self, cache=None, blocksize=1024 * 1024):
+        self.cache = cache
+        self.blocksize = blocksize
+
+    def copy(self, source, dest):
+        source, dest = Path(source), Path(dest)
+        sha = self._cached_hash(source)
+        with source.open("rb") as fsrc, dest.open("wb") as fdst:
+            # with no cache to fill, hashing on the way would be wasted
+            in_kernel = self.cache is None or sha is not None
+            if not (in_kernel and _copy_in_kernel(fsrc, fdst)):
+                sha = self._copy_through_buffer(fsrc, fdst, self.cache is not None)
+        shutil.copymode(source, dest)
+        self._remember(dest, sha)
+
+    def move(self, source, dest):
+        source, dest = Path(source), Path(dest)
+        sha = self._cached_hash(source)
+        os.replace(source, dest)
+        self._remember(dest, sha)
+
+    def delete(self, dest):
+        os.remove(dest)
+
+    def _cached_hash(self, path):
+        if self.cache is None:
+            return None
+        return self.cache.get(path, path.stat())
+
+    def _remember(self, path, sha):
+        if self.cache is not None and sha is not None:
+            self.cache.put(path, path.stat(), sha)
+
+    def _copy_through_buffer(self, fsrc, fdst, hashing):
+        hasher = hashlib.sha1() if hashing else None
+        size = os.fstat(fsrc.fileno()).st_size
+        buf = bytearray(max(min(self.blocksize, size), 1))
+        view = memoryview(buf)
+        while True:
+            n = fsrc.readinto(buf)
+            if not n:
+                return hasher.hexdigest() if hashing else None
+            if hashing:
+                hasher.update(view[:n])
+            fdst.write(view[:n])
+
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int), from linux/fs.h
+# errors meaning "this way of copying isn't available here", not a real failure
+_UNSUPPORTED = frozenset(
+    {errno.EBADF, errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.ENOTTY, errno.EXDEV}
+)
+
+
+# (method, source device, destination device) combinations known not to work
+_unsupported_methods = set()
+
+
+def _copy_in_kernel(fsrc, fdst):
+    """Copy fsrc to the empty fdst without going through userspace.
+
+    Returns False, having written nothing, if no kernel-side copy works for
+    these two files.  Methods that fail between a pair of devices aren't
+    tried again for that pair.
+    """
+    src_stat, dst_stat = os.fstat(fsrc.fileno()), os.fstat(fdst.fileno())
+    for method in (_reflink, _copy_file_range, _sendfile):
+        key = (method.__name__, src_stat.st_dev, dst_stat.st_dev)
+        if key in _unsupported_methods:
+            continue
+        try:
+            method(fsrc.fileno(), fdst.fileno(), src_stat.st_size)
+            return True
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno not in _UNSUPPORTED:
+                raise
+            _unsupported_methods.add(key)
+            if os.fstat(fdst.fileno()).st_size:
+                os.ftruncate(fdst.fileno(), 0)
+            fdst.seek(0)
+    return False
+
+
+def _reflink(src_fd, dst_fd, size):
+    import fcntl
+
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(src_fd, dst_fd, size - offset, offset, offset)
+        if not copied:
+            break
+        offset += copied
+
+
+def _sendfile(src_fd, dst_fd, size):
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+        if not sent:
+            break
+        offset += sent
+
+
+class HashCache:
+    """SHA-1s of files already hashed, kept in a SQLite file between runs.
+
+    An entry is only trusted while the file's size, mtime_ns and inode are
+    the ones it was hashed with; any change to the file means a re-hash.
+    """
+
+    def __init__(self, path, commit_every=10000):
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " sha1 TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._commit_every = commit_every
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def get(self, path, stat):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, inode, sha1 FROM hashes WHERE path = ?",
+                (os.path.abspath(path),),
+            ).fetchone()
+        if row is None or tuple(row[:3]) != _stat_key(stat):
+            return None
+        return row[3]
+
+    def put(self, path, stat, sha):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                (os.path.abspath(path), *_stat_key(stat), sha),
+            )
+            self._pending += 1
+            if self._pending >= self._commit_every:
+                self._db.commit()
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def _stat_key(stat):
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def read_paths_and_hashes(path, cache=None, workers=HASH_WORKERS):
     hashes = {}
-    for folder, _, files in os.walk(path):
-        for filename in files:
-            hashes[hash_file(Path(folder, filename))] = filename
+    for filepath, sha in iter_file_hashes(path, cache, workers):
+        hashes[sha] = filepath.name
+    return hashes
+
+
+def iter_file_hashes(path, cache=None, workers=HASH_WORKERS):
+    """Yield (path, sha1) for every file under path, in sorted walk order.
+
+    Cache misses are hashed on a pool of `workers` threads, with only a few
+    files per worker in flight at once, so memory use doesn't grow with the
+    size of the tree.
+    """
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for filepath in _walk_files(path):
+            stat = filepath.stat()
+            sha = cache.get(filepath, stat) if cache is not None else None
+            if sha is None:
+                sha = pool.submit(hash_file, filepath)
+            in_flight.append((filepath, stat, sha))
+            if len(in_flight) > workers * 4:
+                yield _resolve_hash(*in_flight.popleft(), cache)
+        while in_flight:
+            yield _resolve_hash(*in_flight.popleft(), cache)
+
+
+def _walk_files(path):
+    for folder, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            yield Path(folder, filename)
+
+
+def _resolve_hash(filepath, stat, sha, cache):
+    if isinstance(sha, Future):
+        sha = sha.result()
+        if cache is not None:
+            cache.put(filepath, stat, sha)
+    return filepath, sha
+
+
+def read_tiered_hashes(source, dst, cache=None, strict=False, workers=HASH_WORKERS):
+    """Hashes for determine_actions, reading as little of either tree as it can.
+
+    Files are grouped by size first: a file whose size appears on only one
+    side can't match anything on the other, so it's never read.  Files that
+    share a size are compared on a hash of their first and last blocks, and
+    only files whose partial hashes also collide get a full SHA-1.  SHA-1s
+    in the cache are used instead of reading the file at all, and those
+    computed here are added to it.  Files that match nothing on the other
+    side get a key unique to them instead of their SHA-1, so duplicate
+    files within one tree are no longer collapsed into one entry.
+
+    strict=True skips the shortcuts and fully hashes every file, as
+    read_paths_and_hashes does.
+    """
+    if strict:
+        return (
+            read_paths_and_hashes(source, cache, workers),
+            read_paths_and_hashes(dst, cache, workers),
+        )
+
+    sides = [_files_by_size(source), _files_by_size(dst)]
+    shared_sizes = sides[0].keys() & sides[1].keys()
+    hashes = ({}, {})
+    candidates = ([], [])
+    for side, files in enumerate(sides):
+        for size, filepaths in files.items():
+            if size in shared_sizes:
+                candidates[side].extend(filepaths)
+            else:
+                hashes[side].update(_unique_keys(side, filepaths))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        stats = {path: path.stat() for paths in candidates for path in paths}
+        # SHA-1s already in the cache cost nothing to compare
+        full = ({}, {})
+        for side, filepaths in enumerate(candidates):
+            for filepath in filepaths:
+                sha = (
+                    cache.get(filepath, stats[filepath]) if cache is not None else None
+                )
+                if sha is not None:
+                    full[side][filepath] = sha
+        uncached = [
+            [path for path in filepaths if path not in full[side]]
+            for side, filepaths in enumerate(candidates)
+        ]
+        partials = [
+            dict(zip(filepaths, pool.map(partial_hash, filepaths)))
+            for filepaths in uncached
+        ]
+        shared_partials = set(partials[0].values()) & set(partials[1].values())
+        # a partial hash can't be compared with a cached full one, so a file
+        # the size of a cached file on the other side is fully hashed too
+        cached_sizes = [{stats[path].st_size for path in by_path} for by_path in full]
+        ambiguous = []
+        for side, by_path in enumerate(partials):
+            for filepath, partial in by_path.items():
+                if not isinstance(partial, tuple):
+                    # small enough that the partial hash read the whole file
+                    full[side][filepath] = partial
+                    if cache is not None:
+                        cache.put(filepath, stats[filepath], partial)
+                elif (
+                    partial in shared_partials
+                    or stats[filepath].st_size in cached_sizes[1 - side]
+                ):
+                    ambiguous.append((side, filepath))
+                else:
+                    hashes[side].update(_unique_keys(side, [filepath]))
+
+        for (side, filepath), sha in zip(
+            ambiguous, _full_hashes(pool, [path for _, path in ambiguous], cache)
+        ):
+            full[side][filepath] = sha
+
+    shared = set(full[0].values()) & set(full[1].values())
+    for side, by_path in enumerate(full):
+        for filepath, sha in by_path.items():
+            if sha in shared:
+                hashes[side][sha] = filepath.name
+            else:
+                hashes[side].update(_unique_keys(side, [filepath]))
     return hashes
 
 
+def partial_hash(path, blocksize=BLOCKSIZE):
+    """SHA-1 of a file's first and last blocks, tagged so it can't pass for a
+    full hash.  Files too small to have a distinct middle are hashed whole
+    and get their real SHA-1 back."""
+    size = path.stat().st_size
+    if size <= 2 * blocksize:
+        return hash_file(path)
+    hasher = hashlib.sha1(str(size).encode())
+    with path.open("rb") as file:
+        hasher.update(file.read(blocksize))
+        file.seek(-blocksize, os.SEEK_END)
+        hasher.update(file.read(blocksize))
+    return ("partial", hasher.hexdigest())
+
+
+def _files_by_size(path):
+    files = {}
+    for filepath in _walk_files(path):
+        files.setdefault(filepath.stat().st_size, []).append(filepath)
+    return files
+
+
+def _unique_keys(side, filepaths):
+    return ((("unique", side, str(filepath)), filepath.name) for filepath in filepaths)
+
+
+def _full_hashes(pool, filepaths, cache):
+    stats = [filepath.stat() for filepath in filepaths]
+    shas = [
+        cache.get(filepath, stat) if cache is not None else None
+        for filepath, stat in zip(filepaths, stats)
+    ]
+    misses = [i for i, sha in enumerate(shas) if sha is None]
+    for i, sha in zip(misses, pool.map(hash_file, [filepaths[i] for i in misses])):
+        shas[i] = sha
+        if cache is not None:
+            cache.put(filepaths[i], stats[i], sha)
+    return shas
+
+
 def determine_actions(source_hashes, dst_hashes, source_folder, dst_folder):
     for sha, filename in source_hashes.items():
         if sha not in dst_hashes:
@@ -85,3 +505,224 @@ def determine_actions(source_hashes, dst_hashes, source_folder, dst_folder):
     for sha, filename in dst_hashes.items():
         if sha not in source_hashes:
             yield "DELETE", Path(dst_folder, filename)
+
+
+def stream_actions(
+    source_folder,
+    dst_folder,
+    cache=None,
+    workers=HASH_WORKERS,
+    spill_dir=None,
+    memory_limit=64 * 1024 * 1024,
+):
+    """determine_actions for trees too big to hold their hashes in memory.
+
+    The destination's hashes are spilled to a SQLite file in spill_dir,
+    whose page cache is capped at memory_limit bytes.  The source is then
+    streamed past it, and each COPY or MOVE is yielded as soon as its file
+    has been hashed, followed by the DELETEs once the scan has finished.
+
+    The actions match determine_actions(read_paths_and_hashes(...)) except
+    when the source holds several files with identical contents: they are
+    acted on for the first of them in sorted walk order, not the last.
+    """
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp:
+        store = sqlite3.connect(str(Path(tmp, "hashes.db")))
+        try:
+            store.execute(f"PRAGMA cache_size = -{max(memory_limit // 1024, 1)}")
+            store.execute("PRAGMA journal_mode = OFF")
+            store.execute("PRAGMA synchronous = OFF")
+            store.execute(
+                "CREATE TABLE dst (sha TEXT PRIMARY KEY, filename TEXT NOT NULL,"
+                " seen INTEGER NOT NULL DEFAULT 0)"
+            )
+            store.execute("CREATE TABLE src (sha TEXT PRIMARY KEY)")
+
+            dst_hashes = (
+                (sha, filepath.name)
+                for filepath, sha in iter_file_hashes(dst_folder, cache, workers)
+            )
+            while True:
+                chunk = list(islice(dst_hashes, 10000))
+                if not chunk:
+                    break
+                store.executemany(
+                    "INSERT OR REPLACE INTO dst (sha, filename) VALUES (?, ?)", chunk
+                )
+
+            for filepath, sha in iter_file_hashes(source_folder, cache, workers):
+                if (
+                    store.execute(
+                        "INSERT OR IGNORE INTO src VALUES (?)", (sha,)
+                    ).rowcount
+                    == 0
+                ):
+                    continue
+                filename = filepath.name
+                row = store.execute(
+                    "SELECT filename FROM dst WHERE sha = ?", (sha,)
+                ).fetchone()
+                if row is None:
+                    yield "COPY", Path(source_folder, filename), Path(
+                        dst_folder, filename
+                    )
+                    continue
+                store.execute("UPDATE dst SET seen = 1 WHERE sha = ?", (sha,))
+                if filename != row[0]:
+                    yield "MOVE", Path(dst_folder, row[0]), Path(dst_folder, filename)
+
+            for (filename,) in store.execute(
+                "SELECT filename FROM dst WHERE seen = 0 ORDER BY rowid"
+            ):
+                yield "DELETE", Path(dst_folder, filename)
+        finally:
+            store.close()
+
+
+class ActionExecutor:
+    """Runs sync actions against a filesystem on a pool of worker threads.
+
+    Actions touching the same destination path keep their relative order,
+    except that a MOVE or DELETE freeing a name always runs before a COPY or
+    MOVE writing onto it.  Moves that form a cycle (a -> b, b -> a) are
+    staged through temporary names.  Transient OS errors are retried with
+    exponential backoff; anything else stops new actions being started and
+    is re-raised once those already running have finished.
+
+    progress, if given, is called as progress(done, total, action) after
+    each action completes.
+
+    Any action may have to wait for any other, so run() reads the whole
+    stream of actions and plans them all before starting: it holds them in
+    memory, at about 1KB per action with the paths, or 1GB for a million
+    changes.  For more than that, split the actions into groups whose
+    paths don't overlap and run each group separately.
+    """
+
+    def __init__(
+        self,
+        workers=ACTION_WORKERS,
+        attempts=3,
+        backoff=0.1,
+        progress=None,
+        is_transient=None,
+    ):
+        self.workers = workers
+        self.attempts = attempts
+        self.backoff = backoff
+        self.progress = progress
+        self.is_transient = is_transient or _is_transient
+
+    def run(self, filesystem, actions):
+        actions = list(actions)
+        dependents, waiting_on, blocked = _plan(actions)
+        total = len(actions)
+        done = 0
+        error = None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            running = {}
+            ready = deque(i for i, count in enumerate(waiting_on) if count == 0)
+            while ready or running:
+                while ready and error is None:
+                    i = ready.popleft()
+                    running[pool.submit(self._apply, filesystem, actions[i])] = i
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+                    done += 1
+                    self._report(done, total, actions[i])
+                    for j in dependents[i]:
+                        if waiting_on[j] is not None:
+                            waiting_on[j] -= 1
+                            if not waiting_on[j]:
+                                ready.append(j)
+        if error is not None:
+            raise error
+
+        # whatever is left waits, directly or not, on moves that form a
+        # cycle: free their sources first, then run the rest in order
+        staged = {}
+        # a suffix unique to this run can't name anything already there,
+        # without having to ask the filesystem, which may not be local
+        suffix = uuid.uuid4().hex
+        for n, i in enumerate(i for i in blocked if actions[i][0] == "MOVE"):
+            _, source, dest = actions[i]
+            temporary = source.with_name(f"{source.name}.sync-{suffix}-{n}")
+            self._apply(filesystem, ("MOVE", source, temporary))
+            staged[i] = ("MOVE", temporary, dest)
+        for i in blocked:
+            self._apply(filesystem, staged.get(i, actions[i]))
+            done += 1
+            self._report(done, total, actions[i])
+
+    def _apply(self, filesystem, action):
+        kind, *paths = action
+        operation = getattr(filesystem, kind.lower())
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return operation(*paths)
+            except Exception as e:
+                if attempt == self.attempts or not self.is_transient(e):
+                    raise
+                sleep(self.backoff * 2 ** (attempt - 1))
+
+    def _report(self, done, total, action):
+        if self.progress is not None:
+            self.progress(done, total, action)
+
+
+def _is_transient(error):
+    return isinstance(error, (TimeoutError, ConnectionError)) or (
+        isinstance(error, OSError) and error.errno in TRANSIENT_ERRNOS
+    )
+
+
+def _plan(actions):
+    """Work out which actions must wait for which.
+
+    Returns the dependents of each action, how many actions each one waits
+    on, and the indexes of actions blocked by a cycle of moves, which are
+    left for run() to stage separately.
+    """
+    freed_by, written_by = {}, {}
+    for i, (kind, *paths) in enumerate(actions):
+        if kind == "COPY":
+            written_by.setdefault(paths[1], []).append(i)
+        elif kind == "MOVE":
+            freed_by.setdefault(paths[0], []).append(i)
+            written_by.setdefault(paths[1], []).append(i)
+        else:
+            freed_by.setdefault(paths[0], []).append(i)
+
+    edges = set()
+    for path in freed_by.keys() | written_by.keys():
+        freers, writers = freed_by.get(path, []), written_by.get(path, [])
+        edges.update((f, w) for f in freers for w in writers if f != w)
+        for same in (freers, writers):
+            edges.update(zip(same, same[1:]))
+
+    dependents = [[] for _ in actions]
+    waiting_on = [0] * len(actions)
+    for before, after in edges:
+        dependents[before].append(after)
+        waiting_on[after] += 1
+
+    # Kahn's algorithm; anything never released sits on or behind a cycle
+    remaining = list(waiting_on)
+    ready = [i for i, count in enumerate(remaining) if not count]
+    while ready:
+        for j in dependents[ready.pop()]:
+            remaining[j] -= 1
+            if not remaining[j]:
+                ready.append(j)
+    blocked = [i for i, count in enumerate(remaining) if count]
+    for i in blocked:
+        # never scheduled on the pool, however many predecessors finish
+        waiting_on[i] = None
+    return dependents, waiting_on, blocked
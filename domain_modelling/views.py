@@ -0,0 +1,43 @@
+from sqlalchemy import func, select
+
+from domain_modelling.adapters.orm import allocations, batches, order_lines
+
+
+def available_stock(sku, session):
+    """Purchased, allocated and available quantity for each batch of a SKU.
+
+    Computed in one GROUP BY over the tables, without loading any domain
+    objects; batches come back in the order allocation would use them.
+    """
+    allocated = func.coalesce(func.sum(order_lines.c.qty), 0)
+    query = (
+        select(
+            batches.c.reference,
+            batches.c.eta,
+            batches.c._purchased_quantity,
+            allocated,
+        )
+        .select_from(
+            batches.outerjoin(
+                allocations, allocations.c.batch_id == batches.c.id
+            ).outerjoin(order_lines, order_lines.c.id == allocations.c.orderline_id)
+        )
+        .where(batches.c.sku == sku)
+        .group_by(
+            batches.c.id,
+            batches.c.reference,
+            batches.c.eta,
+            batches.c._purchased_quantity,
+        )
+        .order_by(batches.c.eta.isnot(None), batches.c.eta, batches.c.reference)
+    )
+    return [
+        {
+            "batchref": reference,
+            "eta": eta.isoformat() if eta is not None else None,
+            "purchased": purchased,
+            "allocated": allocated,
+            "available": purchased - allocated,
+        }
+        for reference, eta, purchased, allocated in session.execute(query)
+    ]
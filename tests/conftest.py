@@ -10,7 +10,13 @@ from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import clear_mappers, sessionmaker
 
 from domain_modelling import config
-from domain_modelling.adapters.orm import metadata, start_mappers
+from domain_modelling.adapters.orm import create_schema, metadata, start_mappers
+from domain_modelling.domain import model
+
+
+@pytest.fixture(autouse=True)
+def check_allocated_quantity(monkeypatch):
+    monkeypatch.setattr(model, "CHECK_ALLOCATED_QUANTITY", True)
 
 
 @pytest.fixture
@@ -27,6 +33,22 @@ def session_factory(in_memory_db):
     clear_mappers()
 
 
+@pytest.fixture
+def sqlite_file_db(tmp_path):
+    # each connection to sqlite:///:memory: gets its own empty database, so
+    # anything that talks to the db from several threads needs a real file
+    engine = create_engine(f"sqlite:///{tmp_path / 'allocation.db'}")
+    metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def sqlite_session_factory(sqlite_file_db):
+    start_mappers()
+    yield sessionmaker(bind=sqlite_file_db)
+    clear_mappers()
+
+
 @pytest.fixture
 def session(in_memory_db):
     start_mappers()
@@ -34,6 +56,21 @@ def session(in_memory_db):
     clear_mappers()
 
 
+@pytest.fixture
+def insert_stock():
+    def _insert_stock(session, sku, batches):
+        session.execute("INSERT INTO products (sku) VALUES (:sku)", dict(sku=sku))
+        for ref, qty in batches:
+            session.execute(
+                "INSERT INTO batches (reference, sku, _purchased_quantity, eta) "
+                "VALUES (:ref, :sku, :qty, NULL)",
+                dict(ref=ref, sku=sku, qty=qty),
+            )
+        session.commit()
+
+    return _insert_stock
+
+
 def wait_for_postgres_to_come_up(engine):
     deadline = time.time() + 10
     while time.time() < deadline:
@@ -59,7 +96,8 @@ def wait_for_webapp_to_come_up():
 def postgres_db():
     engine = create_engine(config.get_postgres_uri())
     wait_for_postgres_to_come_up(engine)
-    metadata.create_all(engine)
+    with engine.begin() as connection:
+        create_schema(connection)
     return engine
 
 
@@ -77,6 +115,10 @@ def add_stock(postgres_session):
 
     def _add_stock(lines):
         for ref, sku, qty, eta in lines:
+            postgres_session.execute(
+                "INSERT INTO products (sku) VALUES (:sku) ON CONFLICT DO NOTHING",
+                dict(sku=sku),
+            )
             postgres_session.execute(
                 "INSERT INTO batches (reference, sku, _purchased_quantity, eta) "
                 "VALUES (:ref, :sku, :qty, :eta)",
@@ -104,6 +146,7 @@ def add_stock(postgres_session):
         postgres_session.execute(
             "DELETE FROM order_lines WHERE sku=:sku", dict(sku=sku)
         )
+        postgres_session.execute("DELETE FROM products WHERE sku=:sku", dict(sku=sku))
         postgres_session.commit()
 
 
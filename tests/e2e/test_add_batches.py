@@ -0,0 +1,51 @@
+import datetime
+import uuid
+
+import pytest
+
+from domain_modelling.adapters import repository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+
+
+@pytest.fixture
+def sku(postgres_session):
+    sku = f"sku-feed-{uuid.uuid4().hex[:6]}"
+    yield sku
+    postgres_session.rollback()
+    postgres_session.execute(
+        "DELETE FROM allocations WHERE batch_id IN"
+        " (SELECT id FROM batches WHERE sku=:sku)",
+        dict(sku=sku),
+    )
+    postgres_session.execute("DELETE FROM order_lines WHERE sku=:sku", dict(sku=sku))
+    postgres_session.execute("DELETE FROM batches WHERE sku=:sku", dict(sku=sku))
+    postgres_session.execute("DELETE FROM products WHERE sku=:sku", dict(sku=sku))
+    postgres_session.commit()
+
+
+def test_add_batches_copies_and_upserts_on_postgres(postgres_session, sku):
+    assert postgres_session.get_bind().dialect.driver == "psycopg2"
+    rows = [
+        {"reference": f"{sku}-1", "sku": sku, "qty": 20, "eta": None},
+        {"reference": f"{sku}-2", "sku": sku, "qty": 30, "eta": None},
+    ]
+    services.add_batches(rows, postgres_session, chunk_size=1)
+
+    later = datetime.date(2030, 1, 2)
+    services.add_batches(
+        [{"reference": f"{sku}-1", "sku": sku, "qty": 50, "eta": later}],
+        postgres_session,
+    )
+
+    assert list(
+        postgres_session.execute(
+            "SELECT reference, _purchased_quantity, eta FROM batches"
+            " WHERE sku=:sku ORDER BY reference",
+            dict(sku=sku),
+        )
+    ) == [(f"{sku}-1", 50, later), (f"{sku}-2", 30, None)]
+    repo = repository.SqlAlchemyRepository(postgres_session)
+    assert repo.get_version(sku) == 3
+    line = model.OrderLine(f"order-{sku}", sku, 40)
+    assert services.allocate(line, repo, postgres_session) == f"{sku}-1"
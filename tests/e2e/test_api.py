@@ -105,3 +105,97 @@ def test_allocations_are_persisted(add_stock):
     r = requests.post(f"{url}/allocate", json=line2)
     assert r.status_code == 201
     assert r.json()["batchref"] == batch2
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_bulk_allocation_returns_a_result_per_line(add_stock):
+    sku, small_sku, unknown_sku = random_sku(), random_sku("small"), random_sku()
+    batch, small_batch = random_batchref(1), random_batchref(2)
+    add_stock([(batch, sku, 100, None), (small_batch, small_sku, 1, None)])
+    orderid = random_orderid()
+    data = {
+        "lines": [
+            {"orderid": orderid, "sku": sku, "qty": 10},
+            {"orderid": orderid, "sku": small_sku, "qty": 10},
+            {"orderid": orderid, "sku": unknown_sku, "qty": 10},
+        ]
+    }
+    url = config.get_api_url()
+    r = requests.post(f"{url}/allocate/bulk", json=data)
+    assert r.status_code == 201
+    assert r.json()["results"] == [
+        {"orderid": orderid, "sku": sku, "batchref": batch},
+        {
+            "orderid": orderid,
+            "sku": small_sku,
+            "message": f"Out of stock for sku {small_sku}",
+        },
+        {
+            "orderid": orderid,
+            "sku": unknown_sku,
+            "message": f"Invalid sku {unknown_sku}",
+        },
+    ]
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_deallocate_then_reallocate(add_stock):
+    sku, orderid = random_sku(), random_orderid()
+    batch1, batch2 = random_batchref(1), random_batchref(2)
+    add_stock([(batch1, sku, 10, "2011-01-01"), (batch2, sku, 10, "2011-01-02")])
+    url = config.get_api_url()
+
+    r = requests.post(
+        f"{url}/allocate", json={"orderid": orderid, "sku": sku, "qty": 10}
+    )
+    assert r.json()["batchref"] == batch1
+
+    r = requests.post(f"{url}/deallocate", json={"orderid": orderid, "sku": sku})
+    assert r.status_code == 200
+    assert r.json()["batchref"] == batch1
+
+    r = requests.post(f"{url}/reallocate", json={"orderid": orderid, "sku": sku})
+    assert r.status_code == 400
+    assert r.json()["message"] == f"Order {orderid} has no allocation for sku {sku}"
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_reallocate_moves_an_order_to_newly_preferred_stock(add_stock):
+    sku, orderid = random_sku(), random_orderid()
+    shipment, warehouse = random_batchref("shipment"), random_batchref("warehouse")
+    add_stock([(shipment, sku, 10, "2011-01-01")])
+    url = config.get_api_url()
+
+    r = requests.post(
+        f"{url}/allocate", json={"orderid": orderid, "sku": sku, "qty": 5}
+    )
+    assert r.json()["batchref"] == shipment
+
+    # stock already in the warehouse is preferred over any shipment
+    add_stock([(warehouse, sku, 10, None)])
+    r = requests.post(f"{url}/reallocate", json={"orderid": orderid, "sku": sku})
+    assert r.status_code == 201
+    assert r.json()["batchref"] == warehouse
+
+
+@pytest.mark.usefixtures("restart_api")
+def test_stock_endpoint_reports_available_quantity(add_stock):
+    sku, batch = random_sku(), random_batchref()
+    add_stock([(batch, sku, 100, None)])
+    url = config.get_api_url()
+    requests.post(
+        f"{url}/allocate", json={"orderid": random_orderid(), "sku": sku, "qty": 30}
+    )
+
+    r = requests.get(f"{url}/stock/{sku}")
+    assert r.status_code == 200
+    assert r.json()["available"] == 70
+    assert r.json()["batches"] == [
+        {
+            "batchref": batch,
+            "eta": None,
+            "purchased": 100,
+            "allocated": 30,
+            "available": 70,
+        }
+    ]
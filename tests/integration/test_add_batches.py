@@ -0,0 +1,117 @@
+import io
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from domain_modelling.adapters import orm, repository, stock_feed
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+
+FEED_CSV = """reference,sku,qty,eta
+batch-1,LAMP,20,
+batch-2,LAMP,30,2030-01-02
+batch-3,TABLE,5,
+"""
+
+
+def batch_rows(session):
+    return list(
+        session.execute(
+            "SELECT reference, sku, _purchased_quantity, eta FROM batches "
+            "ORDER BY reference"
+        )
+    )
+
+
+def test_add_batches_inserts_batches_and_their_products(session):
+    count = services.add_batches(stock_feed.read_csv(io.StringIO(FEED_CSV)), session)
+
+    assert count == 3
+    assert batch_rows(session) == [
+        ("batch-1", "LAMP", 20, None),
+        ("batch-2", "LAMP", 30, "2030-01-02"),
+        ("batch-3", "TABLE", 5, None),
+    ]
+    assert sorted(session.execute("SELECT sku, version_number FROM products")) == [
+        ("LAMP", 1),
+        ("TABLE", 1),
+    ]
+
+
+def test_add_batches_upserts_on_reference(session):
+    repo = repository.SqlAlchemyRepository(session)
+    repo.add(model.Batch("batch-1", "LAMP", 10, eta=None))
+    session.commit()
+    feed = io.StringIO(
+        '{"reference": "batch-1", "sku": "LAMP", "qty": 50, "eta": "2030-01-02"}\n'
+        "\n"
+        '{"reference": "batch-2", "sku": "LAMP", "qty": 5, "eta": null}\n'
+    )
+
+    services.add_batches(stock_feed.read_jsonl(feed), session)
+
+    assert batch_rows(session) == [
+        ("batch-1", "LAMP", 50, "2030-01-02"),
+        ("batch-2", "LAMP", 5, None),
+    ]
+    assert repo.get_version("LAMP") == 1
+
+
+def test_added_batches_can_be_allocated_to(session):
+    services.add_batches(stock_feed.read_csv(io.StringIO(FEED_CSV)), session)
+    repo = repository.SqlAlchemyRepository(session)
+
+    batchref = services.allocate(model.OrderLine("o1", "LAMP", 25), repo, session)
+
+    assert batchref == "batch-2"
+
+
+def test_add_batches_commits_each_chunk(session):
+    rows = [
+        {"reference": f"batch-{i}", "sku": "LAMP", "qty": 10, "eta": None}
+        for i in range(5)
+    ]
+    rows.append({"reference": "broken", "sku": "LAMP", "qty": None, "eta": None})
+
+    with pytest.raises(IntegrityError):
+        services.add_batches(iter(rows), session, chunk_size=2)
+    session.rollback()
+
+    assert [ref for ref, *_ in batch_rows(session)] == [
+        "batch-0",
+        "batch-1",
+        "batch-2",
+        "batch-3",
+    ]
+
+
+def test_later_rows_for_a_reference_win(session):
+    feed = io.StringIO(FEED_CSV + "batch-1,LAMP,99,\n")
+
+    services.add_batches(stock_feed.read_csv(feed), session)
+
+    assert batch_rows(session)[0] == ("batch-1", "LAMP", 99, None)
+
+
+def test_create_schema_adds_the_unique_reference_to_older_tables():
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(
+            "CREATE TABLE products (sku VARCHAR(255) PRIMARY KEY,"
+            " version_number INTEGER NOT NULL DEFAULT 0)"
+        )
+        connection.execute(
+            "CREATE TABLE batches (id INTEGER PRIMARY KEY,"
+            " reference VARCHAR(255), sku VARCHAR(255),"
+            " _purchased_quantity INTEGER NOT NULL, eta DATE)"
+        )
+        orm.create_schema(connection)
+        orm.create_schema(connection)
+    session = Session(bind=engine)
+
+    services.add_batches(stock_feed.read_csv(io.StringIO(FEED_CSV)), session)
+    services.add_batches(stock_feed.read_csv(io.StringIO(FEED_CSV)), session)
+
+    assert len(batch_rows(session)) == 3
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import subprocess
+import sys
+
+import pytest
+
+from domain_modelling.entrypoints import asgi_app
+
+pytest.importorskip("aiosqlite")
+
+
+@pytest.fixture
+def app(sqlite_session_factory):
+    session = sqlite_session_factory()
+    session.execute("INSERT INTO products (sku) VALUES ('RED-CHAIR')")
+    session.execute(
+        "INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
+        " VALUES ('batch1', 'RED-CHAIR', 10, NULL)"
+    )
+    session.commit()
+    database = sqlite_session_factory.kw["bind"].url.database
+    return asgi_app.create_app(
+        {"database_uri": f"sqlite+aiosqlite:///{database}", "engine_options": {}}
+    )
+
+
+def serve(app, *bodies):
+    """Start app up, POST each body to /allocate, then shut it down.
+
+    Returns (status, payload) for each request.
+    """
+
+    async def request(body):
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": "/allocate"}
+        await app(scope, receive, send)
+        return sent[0]["status"], json.loads(sent[1]["body"])
+
+    async def scenario():
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        lifespan = asyncio.create_task(app({"type": "lifespan"}, inbox.get, outbox.put))
+        await inbox.put({"type": "lifespan.startup"})
+        assert (await outbox.get())["type"] == "lifespan.startup.complete"
+        responses = [await request(body) for body in bodies]
+        await inbox.put({"type": "lifespan.shutdown"})
+        await lifespan
+        return responses
+
+    return asyncio.run(scenario())
+
+
+def test_importing_the_app_maps_nothing():
+    check = (
+        "from sqlalchemy import inspect\n"
+        "from domain_modelling.domain import model\n"
+        "from domain_modelling.entrypoints import asgi_app\n"
+        "assert inspect(model.Batch, raiseerr=False) is None\n"
+    )
+    subprocess.run([sys.executable, "-c", check], check=True)
+
+
+def test_allocates_and_reports_errors_as_400s(app):
+    responses = serve(
+        app,
+        b'{"orderid": "o1", "sku": "RED-CHAIR", "qty": 3}',
+        b'{"orderid": "o2", "sku": "RED-CHAIR", "qty": 8}',
+        b'{"orderid": "o3", "sku": "NONEXISTENT", "qty": 1}',
+        b'{"orderid": "o4", "sku": "RED-CHAIR"}',
+        b"[]",
+        b"not json",
+    )
+
+    assert responses == [
+        (201, {"batchref": "batch1"}),
+        (400, {"message": "Out of stock for sku RED-CHAIR"}),
+        (400, {"message": "Invalid sku NONEXISTENT"}),
+        (400, {"message": "Missing field 'qty'"}),
+        (400, {"message": "Request body must be a JSON object"}),
+        (400, {"message": "Request body is not valid JSON"}),
+    ]
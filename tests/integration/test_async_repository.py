@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from domain_modelling import instrumentation
+from domain_modelling.adapters.async_repository import AsyncSqlAlchemyRepository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+
+pytest.importorskip("aiosqlite")
+
+
+@pytest.fixture
+def async_session_factory(sqlite_session_factory):
+    database = sqlite_session_factory.kw["bind"].url.database
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database}")
+    yield sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+def test_async_repository_round_trip(async_session_factory):
+    async def scenario():
+        async with async_session_factory() as session:
+            repo = AsyncSqlAlchemyRepository(session)
+            await repo.add(model.Batch("b1", "LAMP", 10, eta=None))
+            await repo.add(model.Batch("b2", "LAMP", 10, eta=None))
+            await session.commit()
+
+        async with async_session_factory() as session:
+            repo = AsyncSqlAlchemyRepository(session)
+            line = model.OrderLine("o1", "LAMP", 4)
+            batchref = await services.allocate_async(line, repo, session)
+
+        async with async_session_factory() as session:
+            repo = AsyncSqlAlchemyRepository(session)
+            product = await repo.get_product("LAMP")
+            batch = await repo.get_allocated_batch("o1", "LAMP")
+            return batchref, product, batch, await repo.get_version("LAMP")
+
+    batchref, product, batch, version = asyncio.run(scenario())
+
+    assert batchref == "b1"
+    assert version == product.version_number == 2
+    assert batch.reference == "b1"
+    assert batch.available_quantity == 6
+
+
+def test_async_allocate_errors_for_invalid_sku(async_session_factory):
+    async def scenario():
+        async with async_session_factory() as session:
+            repo = AsyncSqlAlchemyRepository(session)
+            line = model.OrderLine("o1", "NONEXISTENTSKU", 4)
+            await services.allocate_async(line, repo, session)
+
+    with pytest.raises(services.InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+        asyncio.run(scenario())
+
+
+def test_concurrent_async_allocations_never_oversell(async_session_factory):
+    async def try_to_allocate(orderid):
+        async with async_session_factory() as session:
+            repo = AsyncSqlAlchemyRepository(session)
+            line = model.OrderLine(orderid, "LAMP", 1)
+            return await services.allocate_async(line, repo, session)
+
+    async def scenario():
+        async with async_session_factory() as session:
+            await AsyncSqlAlchemyRepository(session).add(
+                model.Batch("b1", "LAMP", 10, eta=None)
+            )
+            await session.commit()
+        return await asyncio.gather(
+            *(try_to_allocate(f"o{i}") for i in range(30)), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+
+    assert 0 < len([r for r in results if r == "b1"]) <= 10
+
+
+def test_async_allocations_are_instrumented_like_sync_ones(async_session_factory):
+    registry = instrumentation.MetricsRegistry()
+    instrumentation.configure(registry)
+
+    async def scenario():
+        async with async_session_factory() as session:
+            repo = AsyncSqlAlchemyRepository(session)
+            await repo.add(model.Batch("b1", "LAMP", 10, eta=None))
+            await session.commit()
+        async with async_session_factory() as session:
+            repo = AsyncSqlAlchemyRepository(session)
+            line = model.OrderLine("o1", "LAMP", 4)
+            return await services.allocate_async(line, repo, session)
+
+    try:
+        assert asyncio.run(scenario()) == "b1"
+        rendered = registry.render()
+    finally:
+        instrumentation.configure(None)
+
+    assert 'service_seconds_count{operation="allocate"} 1' in rendered
+    assert "commit_seconds_count 1" in rendered
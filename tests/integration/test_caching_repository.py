@@ -0,0 +1,160 @@
+import threading
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from domain_modelling.adapters import repository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+from domain_modelling.service_layer.unit_of_work import session_scope
+
+
+@pytest.fixture
+def cached_session_factory(sqlite_session_factory):
+    return sessionmaker(bind=sqlite_session_factory.kw["bind"], expire_on_commit=False)
+
+
+def add_stock(session_factory, batches):
+    session = session_factory()
+    repo = repository.SqlAlchemyRepository(session)
+    for batch in batches:
+        repo.add(batch)
+    session.commit()
+    session.close()
+
+
+def allocate(session_factory, cache, orderid, sku, qty):
+    with session_scope(session_factory) as session:
+        repo = repository.CachingRepository(
+            repository.SqlAlchemyRepository(session), cache
+        )
+        return services.allocate(model.OrderLine(orderid, sku, qty), repo, session)
+
+
+def test_second_request_is_served_from_the_cache(cached_session_factory):
+    add_stock(cached_session_factory, [model.Batch("b1", "LAMP", 10, eta=None)])
+    cache = repository.ProductCache(max_size=10)
+
+    assert allocate(cached_session_factory, cache, "o1", "LAMP", 4) == "b1"
+    assert allocate(cached_session_factory, cache, "o2", "LAMP", 4) == "b1"
+    with pytest.raises(model.OutOfStock):
+        allocate(cached_session_factory, cache, "o3", "LAMP", 4)
+
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+    session = cached_session_factory()
+    assert session.query(model.Product).one().version_number == 2
+    assert session.query(model.Batch).one().available_quantity == 2
+
+
+def test_stale_entries_are_reloaded(cached_session_factory):
+    add_stock(cached_session_factory, [model.Batch("b1", "LAMP", 10, eta=None)])
+    cache = repository.ProductCache(max_size=10)
+    allocate(cached_session_factory, cache, "o1", "LAMP", 4)
+
+    # another worker, with its own cache, allocates behind our back
+    allocate(cached_session_factory, repository.ProductCache(10), "o2", "LAMP", 4)
+
+    with pytest.raises(model.OutOfStock):
+        allocate(cached_session_factory, cache, "o3", "LAMP", 4)
+    assert cache.stats()["hits"] == 0
+    assert cache.stats()["misses"] == 2
+
+
+def test_rolled_back_products_are_not_reused(cached_session_factory):
+    add_stock(cached_session_factory, [model.Batch("b1", "LAMP", 10, eta=None)])
+    cache = repository.ProductCache(max_size=10)
+    allocate(cached_session_factory, cache, "o1", "LAMP", 4)
+
+    session = cached_session_factory()
+    repo = repository.CachingRepository(repository.SqlAlchemyRepository(session), cache)
+    repo.get_product("LAMP").allocate(model.OrderLine("o2", "LAMP", 4))
+    session.rollback()
+    session.close()
+
+    assert allocate(cached_session_factory, cache, "o3", "LAMP", 6) == "b1"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_products_a_rollback_left_unchanged_stay_cached(cached_session_factory):
+    add_stock(cached_session_factory, [model.Batch("b1", "LAMP", 10, eta=None)])
+    cache = repository.ProductCache(max_size=10)
+    allocate(cached_session_factory, cache, "o1", "LAMP", 10)
+
+    for orderid in ("o2", "o3", "o4"):
+        with pytest.raises(model.OutOfStock):
+            allocate(cached_session_factory, cache, orderid, "LAMP", 1)
+
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+    session = cached_session_factory()
+    add_stock(cached_session_factory, [model.Batch("b2", "LAMP", 5, eta=None)])
+    assert allocate(cached_session_factory, cache, "o5", "LAMP", 5) == "b2"
+    assert (
+        session.query(model.Batch).filter_by(reference="b1").one().allocated_quantity
+        == 10
+    )
+
+
+def test_only_the_committed_attempt_goes_back_into_the_cache(
+    cached_session_factory, monkeypatch
+):
+    add_stock(cached_session_factory, [model.Batch("b1", "LAMP", 10, eta=None)])
+    cache = repository.ProductCache(max_size=10)
+    put_back = []
+    monkeypatch.setattr(cache, "put", lambda sku, product: put_back.append(product))
+
+    session = cached_session_factory()
+    repo = repository.CachingRepository(repository.SqlAlchemyRepository(session), cache)
+    # a first attempt that loses a version conflict, then the retry
+    repo.get_product("LAMP").allocate(model.OrderLine("o1", "LAMP", 4))
+    session.rollback()
+    product = repo.get_product("LAMP")
+    product.allocate(model.OrderLine("o1", "LAMP", 4))
+    session.commit()
+
+    assert put_back == [product]
+
+
+def test_least_recently_used_products_are_evicted(cached_session_factory):
+    add_stock(
+        cached_session_factory,
+        [model.Batch(f"b-{sku}", sku, 10, eta=None) for sku in ("A", "B", "C")],
+    )
+    cache = repository.ProductCache(max_size=2)
+
+    for sku in ("A", "B", "C", "C"):
+        allocate(cached_session_factory, cache, f"o-{sku}", sku, 1)
+
+    assert cache.stats() == {
+        "size": 2,
+        "max_size": 2,
+        "hits": 1,
+        "misses": 3,
+        "evictions": 1,
+    }
+
+
+def test_shared_cache_never_oversells(cached_session_factory):
+    add_stock(cached_session_factory, [model.Batch("b1", "LAMP", 10, eta=None)])
+    cache = repository.ProductCache(max_size=10)
+    results = []
+
+    def try_to_allocate(orderid):
+        try:
+            results.append(allocate(cached_session_factory, cache, orderid, "LAMP", 1))
+        except Exception as e:  # pylint: disable=broad-except
+            results.append(e)
+
+    threads = [
+        threading.Thread(target=try_to_allocate, args=(f"o{i}",)) for i in range(30)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    session = cached_session_factory()
+    allocated = session.query(model.Batch).one().allocated_quantity
+    assert allocated == len([r for r in results if r == "b1"]) <= 10
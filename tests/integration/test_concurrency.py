@@ -0,0 +1,83 @@
+import threading
+
+from domain_modelling.adapters import repository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+
+
+def try_to_allocate(session_factory, orderid, sku, results):
+    session = session_factory()
+    repo = repository.SqlAlchemyRepository(session)
+    line = model.OrderLine(orderid, sku, 1)
+    try:
+        results.append(services.allocate(line, repo, session))
+    except Exception as e:  # pylint: disable=broad-except
+        results.append(e)
+    finally:
+        session.close()
+
+
+def test_concurrent_allocations_never_oversell(sqlite_session_factory, insert_stock):
+    sku = "HOT_TABLE"
+    session = sqlite_session_factory()
+    insert_stock(session, sku, [("batch1", 10), ("batch2", 5)])
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=try_to_allocate,
+            args=(sqlite_session_factory, f"order{i}", sku, results),
+        )
+        for i in range(40)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    successes = [r for r in results if isinstance(r, str)]
+    [[allocated]] = session.execute(
+        "SELECT COALESCE(SUM(ol.qty), 0) FROM allocations a "
+        "JOIN order_lines ol ON ol.id = a.orderline_id"
+    )
+    [[version]] = session.execute(
+        "SELECT version_number FROM products WHERE sku=:sku", dict(sku=sku)
+    )
+    per_batch = dict(
+        list(
+            session.execute(
+                "SELECT b.reference, COUNT(a.id) FROM batches b "
+                "LEFT JOIN allocations a ON a.batch_id = b.id GROUP BY b.reference"
+            )
+        )
+    )
+
+    assert len(results) == 40
+    assert allocated == len(successes) <= 15
+    assert version == len(successes)
+    assert per_batch["batch1"] <= 10
+    assert per_batch["batch2"] <= 5
+
+
+def test_allocations_to_different_skus_do_not_conflict(
+    sqlite_session_factory, insert_stock
+):
+    session = sqlite_session_factory()
+    skus = [f"SKU{i}" for i in range(8)]
+    for sku in skus:
+        insert_stock(session, sku, [(f"batch-{sku}", 100)])
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=try_to_allocate,
+            args=(sqlite_session_factory, f"order-{sku}", sku, results),
+        )
+        for sku in skus
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(results) == sorted(f"batch-{sku}" for sku in skus)
@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+from domain_modelling.service_layer.coordinator import AllocationCoordinator
+
+
+class CountingSessionFactory:
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.sessions = 0
+
+    def __call__(self):
+        self.sessions += 1
+        return self.session_factory()
+
+
+def allocate_concurrently(coordinator, lines):
+    # lines are expired once committed, so results are keyed by position
+    results = {}
+
+    def allocate(i, line):
+        try:
+            results[i] = coordinator.allocate(line)
+        except Exception as e:  # pylint: disable=broad-except
+            results[i] = e
+
+    threads = [
+        threading.Thread(target=allocate, args=(i, line))
+        for i, line in enumerate(lines)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_coalesced_allocations_fill_batches_in_order(
+    sqlite_session_factory, insert_stock
+):
+    session = sqlite_session_factory()
+    insert_stock(session, "HOT_TABLE", [("batch1", 10), ("batch2", 5)])
+    sessions = CountingSessionFactory(sqlite_session_factory)
+    coordinator = AllocationCoordinator(sessions, window=0.05, max_group=8)
+    lines = [model.OrderLine(f"order{i}", "HOT_TABLE", 1) for i in range(40)]
+
+    results = allocate_concurrently(coordinator, lines)
+
+    batchrefs = [r for r in results.values() if isinstance(r, str)]
+    out_of_stock = [r for r in results.values() if isinstance(r, model.OutOfStock)]
+    assert sorted(batchrefs) == ["batch1"] * 10 + ["batch2"] * 5
+    assert len(out_of_stock) == 25
+    assert 5 <= sessions.sessions < 40
+    [[version]] = session.execute(
+        "SELECT version_number FROM products WHERE sku='HOT_TABLE'"
+    )
+    assert version == 15
+
+
+def test_coalescing_gives_the_same_results_as_one_at_a_time(
+    sqlite_session_factory, insert_stock
+):
+    session = sqlite_session_factory()
+    insert_stock(session, "LAMP", [("batch1", 7), ("batch2", 4)])
+    insert_stock(session, "TABLE", [("batch3", 3)])
+    coordinator = AllocationCoordinator(sqlite_session_factory, window=0)
+    lines = [
+        model.OrderLine("o1", "LAMP", 5),
+        model.OrderLine("o2", "LAMP", 3),
+        model.OrderLine("o3", "TABLE", 3),
+        model.OrderLine("o4", "LAMP", 2),
+        model.OrderLine("o5", "LAMP", 4),
+        model.OrderLine("o6", "NOPE", 1),
+    ]
+
+    results = []
+    for line in lines:
+        try:
+            results.append(coordinator.allocate(line))
+        except (model.OutOfStock, services.InvalidSku) as e:
+            results.append(type(e))
+
+    assert results == [
+        "batch1",
+        "batch2",
+        "batch3",
+        "batch1",
+        model.OutOfStock,
+        services.InvalidSku,
+    ]
+
+
+def test_errors_reach_every_caller_in_the_group(sqlite_session_factory):
+    def broken_session():
+        raise RuntimeError("database is down")
+
+    coordinator = AllocationCoordinator(broken_session, window=0.05)
+    lines = [model.OrderLine(f"order{i}", "LAMP", 1) for i in range(5)]
+
+    results = allocate_concurrently(coordinator, lines)
+
+    assert all(isinstance(r, RuntimeError) for r in results.values())
+    with pytest.raises(RuntimeError):
+        coordinator.allocate(model.OrderLine("order-late", "LAMP", 1))
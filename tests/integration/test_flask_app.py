@@ -0,0 +1,183 @@
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from domain_modelling import instrumentation
+from domain_modelling.adapters import orm
+from domain_modelling.entrypoints import flask_app
+
+
+@pytest.fixture
+def settings(sqlite_file_db, sqlite_session_factory):
+    session = sqlite_session_factory()
+    session.execute("INSERT INTO products (sku) VALUES ('RED-CHAIR')")
+    session.execute(
+        "INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
+        " VALUES ('batch1', 'RED-CHAIR', 10, NULL)"
+    )
+    session.commit()
+    return {
+        "database_uri": str(sqlite_file_db.url),
+        "engine_options": dict(poolclass=QueuePool, pool_size=3),
+        "product_cache_size": 0,
+        "metrics_sink": "",
+        "allocation_coalescing": {"window": 0, "max_group": 1},
+        "allocation_partitions": 0,
+        "warm_up": True,
+    }
+
+
+@pytest.fixture
+def app(settings):
+    return flask_app.create_app(settings)
+
+
+def test_importing_the_app_maps_nothing():
+    check = (
+        "from sqlalchemy import inspect\n"
+        "from domain_modelling.domain import model\n"
+        "from domain_modelling.entrypoints import flask_app\n"
+        "assert inspect(model.Batch, raiseerr=False) is None\n"
+    )
+    subprocess.run([sys.executable, "-c", check], check=True)
+
+
+def test_start_mappers_is_idempotent(sqlite_session_factory):
+    orm.start_mappers()
+    orm.start_mappers()
+
+
+def test_warm_up_fills_the_pool_before_serving(app):
+    assert app.extensions["allocation"].database.engine.pool.checkedin() == 3
+
+    response = app.test_client().post(
+        "/allocate", json={"orderid": "o1", "sku": "RED-CHAIR", "qty": 3}
+    )
+
+    assert response.status_code == 201
+    assert response.get_json() == {"batchref": "batch1"}
+
+
+def test_a_forked_process_gets_its_own_engine(app, monkeypatch):
+    database = app.extensions["allocation"].database
+    parent_engine = database.engine
+
+    monkeypatch.setattr(flask_app.os, "getpid", lambda: -1)
+
+    assert database.engine is not parent_engine
+    assert database.engine is database.engine
+    response = app.test_client().get("/stock/RED-CHAIR")
+    assert response.get_json()["available"] == 10
+
+
+def test_request_metrics_are_finished_when_a_view_raises(app):
+    registry = instrumentation.MetricsRegistry()
+    instrumentation.configure(registry)
+    app.testing = True  # errors propagate, so after_request never runs
+
+    @app.route("/broken")
+    def broken():
+        raise RuntimeError("boom")
+
+    try:
+        with pytest.raises(RuntimeError):
+            app.test_client().get("/broken")
+        assert instrumentation._request_sql.get() is None
+        assert 'http_request_seconds_count{endpoint="broken",status="500"} 1' in (
+            registry.render()
+        )
+    finally:
+        instrumentation.configure(None)
+
+
+def test_allocations_go_through_the_partitioned_workers(settings):
+    app = flask_app.create_app({**settings, "allocation_partitions": 2})
+    client = app.test_client()
+    try:
+        response = client.post(
+            "/allocate", json={"orderid": "o1", "sku": "RED-CHAIR", "qty": 3}
+        )
+        assert response.status_code == 201
+        assert response.get_json() == {"batchref": "batch1"}
+        response = client.post(
+            "/allocate", json={"orderid": "o2", "sku": "RED-CHAIR", "qty": 8}
+        )
+        assert response.status_code == 400
+
+        # the reply waited for the commit
+        assert client.get("/stock/RED-CHAIR").get_json()["available"] == 7
+    finally:
+        app.extensions["allocation"].allocator.close()
+
+
+def test_partitioned_workers_see_stock_freed_outside_them(settings):
+    app = flask_app.create_app({**settings, "allocation_partitions": 1})
+    client = app.test_client()
+    try:
+        line = {"orderid": "o1", "sku": "RED-CHAIR", "qty": 10}
+        assert client.post("/allocate", json=line).status_code == 201
+        response = client.post(
+            "/deallocate", json={"orderid": "o1", "sku": "RED-CHAIR"}
+        )
+        assert response.status_code == 200
+
+        response = client.post(
+            "/allocate", json={"orderid": "o2", "sku": "RED-CHAIR", "qty": 5}
+        )
+        assert response.status_code == 201
+        assert response.get_json() == {"batchref": "batch1"}
+        assert client.get("/stock/RED-CHAIR").get_json()["available"] == 5
+    finally:
+        app.extensions["allocation"].allocator.close()
+
+
+def test_bulk_allocation_returns_a_result_per_line(app):
+    response = app.test_client().post(
+        "/allocate/bulk",
+        json={
+            "lines": [
+                {"orderid": "o1", "sku": "RED-CHAIR", "qty": 6},
+                {"orderid": "o1", "sku": "RED-CHAIR", "qty": 6},
+                {"orderid": "o1", "sku": "NONEXISTENT", "qty": 1},
+            ]
+        },
+    )
+
+    assert response.status_code == 201
+    assert response.get_json()["results"] == [
+        {"orderid": "o1", "sku": "RED-CHAIR", "batchref": "batch1"},
+        {
+            "orderid": "o1",
+            "sku": "RED-CHAIR",
+            "message": "Out of stock for sku RED-CHAIR",
+        },
+        {"orderid": "o1", "sku": "NONEXISTENT", "message": "Invalid sku NONEXISTENT"},
+    ]
+
+
+def test_bulk_allocation_reads_the_same_however_many_lines(app):
+    selects = []
+
+    def count_selects(conn, cursor, statement, *_):
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append(statement)
+
+    engine = app.extensions["allocation"].database.engine
+    event.listen(engine, "before_cursor_execute", count_selects)
+    try:
+        counts = []
+        for n in (2, 5):
+            selects.clear()
+            lines = [
+                {"orderid": f"o{n}-{i}", "sku": "RED-CHAIR", "qty": 1} for i in range(n)
+            ]
+            response = app.test_client().post("/allocate/bulk", json={"lines": lines})
+            assert response.status_code == 201
+            counts.append(len(selects))
+    finally:
+        event.remove(engine, "before_cursor_execute", count_selects)
+
+    assert counts[0] == counts[1]
@@ -1,4 +1,4 @@
-from domain_modelling import model
+from domain_modelling.domain import model
 
 
 def test_orderline_mapper_can_load_lines(session):
@@ -0,0 +1,107 @@
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+from domain_modelling.service_layer.partitioned import (
+    PartitionedAllocator,
+    WorkerDied,
+    _Worker,
+    worker_for,
+)
+
+
+def allocations(session):
+    return set(
+        session.execute(
+            "SELECT b.reference, ol.orderid FROM allocations a"
+            " JOIN batches b ON a.batch_id = b.id"
+            " JOIN order_lines ol ON a.orderline_id = ol.id"
+        )
+    )
+
+
+def test_each_sku_has_a_stable_worker():
+    assert worker_for("RED-CHAIR", 4) == worker_for("RED-CHAIR", 4)
+    assert {worker_for(f"SKU-{i}", 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+def test_allocates_on_the_owning_worker_and_replies_once_committed(
+    sqlite_file_db, sqlite_session_factory, insert_stock
+):
+    session = sqlite_session_factory()
+    insert_stock(session, "RED-CHAIR", [("b1", 10)])
+    insert_stock(session, "BLUE-LAMP", [("b2", 5)])
+
+    with PartitionedAllocator(
+        str(sqlite_file_db.url), workers=2, flush_interval=60
+    ) as allocator:
+        assert allocator.allocate(model.OrderLine("o1", "RED-CHAIR", 6)) == "b1"
+        assert allocator.allocate(model.OrderLine("o2", "BLUE-LAMP", 5)) == "b2"
+        assert allocations(session) == {("b1", "o1"), ("b2", "o2")}
+        with pytest.raises(model.OutOfStock):
+            allocator.allocate(model.OrderLine("o3", "RED-CHAIR", 6))
+        with pytest.raises(services.InvalidSku):
+            allocator.allocate(model.OrderLine("o4", "NONEXISTENT", 1))
+
+        assert allocator.allocate(model.OrderLine("o5", "RED-CHAIR", 4)) == "b1"
+
+    assert allocations(session) == {("b1", "o1"), ("b2", "o2"), ("b1", "o5")}
+    versions = set(session.execute("SELECT sku, version_number FROM products"))
+    assert versions == {("RED-CHAIR", 2), ("BLUE-LAMP", 1)}
+
+
+def test_a_failed_commit_allocates_the_held_lines_again(
+    sqlite_session_factory, insert_stock
+):
+    session = sqlite_session_factory()
+    insert_stock(session, "RED-CHAIR", [("b1", 10)])
+    worker = _Worker(
+        sessionmaker(bind=sqlite_session_factory.kw["bind"], expire_on_commit=False)()
+    )
+
+    worker.allocate(1, "o1", "RED-CHAIR", 6)
+    worker.allocate(2, "o2", "RED-CHAIR", 4)
+    # a stock feed shrinks the batch, and bumps the product's version, before
+    # the worker commits
+    services.add_batches(
+        [{"reference": "b1", "sku": "RED-CHAIR", "qty": 8, "eta": None}], session
+    )
+    (first, second) = worker.commit()
+
+    assert first == (1, "b1", None)
+    assert second[:2] == (2, None)
+    assert isinstance(second[2], model.OutOfStock)
+    assert allocations(session) == {("b1", "o1")}
+
+
+def test_unexpected_errors_are_raised_to_the_caller(tmp_path):
+    # no tables, so loading the product fails
+    with PartitionedAllocator(
+        f"sqlite:///{tmp_path / 'empty.db'}", workers=1
+    ) as allocator:
+        with pytest.raises(OperationalError):
+            allocator.allocate(model.OrderLine("o1", "RED-CHAIR", 1))
+
+
+def test_calls_to_a_dead_worker_fail(sqlite_file_db):
+    with PartitionedAllocator(str(sqlite_file_db.url), workers=1) as allocator:
+        process = allocator._processes[0]
+        os.kill(process.pid, signal.SIGSTOP)
+        waiting = ThreadPoolExecutor(1).submit(
+            allocator.allocate, model.OrderLine("o1", "RED-CHAIR", 1)
+        )
+        while not allocator._pending:
+            time.sleep(0.01)
+        process.kill()
+
+        with pytest.raises(WorkerDied):
+            waiting.result(timeout=10)
+        with pytest.raises(WorkerDied):
+            allocator.allocate(model.OrderLine("o2", "RED-CHAIR", 1))
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+from domain_modelling.adapters.pool import MeteredQueuePool
+
+
+@pytest.fixture
+def single_connection_engine(tmp_path):
+    return create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=MeteredQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.5,
+    )
+
+
+def test_records_each_checkout(single_connection_engine):
+    for _ in range(3):
+        with single_connection_engine.connect() as conn:
+            conn.execute("SELECT 1")
+
+    stats = single_connection_engine.pool.stats()
+    assert stats["checkouts"] == 3
+    assert stats["timeouts"] == 0
+    assert stats["checked_out"] == 0
+    assert sum(stats["wait_seconds_buckets"].values()) == 3
+
+
+def test_records_time_spent_waiting_for_a_busy_pool(single_connection_engine):
+    holding = threading.Event()
+
+    def hold_the_only_connection():
+        with single_connection_engine.connect():
+            holding.set()
+            time.sleep(0.2)
+
+    holder = threading.Thread(target=hold_the_only_connection)
+    holder.start()
+    holding.wait()
+    with single_connection_engine.connect():
+        pass
+    holder.join()
+
+    stats = single_connection_engine.pool.stats()
+    assert stats["checkouts"] == 2
+    assert stats["max_wait_seconds"] >= 0.1
+
+
+def test_records_checkout_timeouts(single_connection_engine):
+    with single_connection_engine.connect():
+        with pytest.raises(PoolTimeout):
+            single_connection_engine.connect()
+
+    stats = single_connection_engine.pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["max_wait_seconds"] >= 0.5
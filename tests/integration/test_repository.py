@@ -1,4 +1,11 @@
-from domain_modelling import model, repository
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from domain_modelling.adapters import repository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
 
 
 def test_repository_can_save_a_batch(session):
@@ -63,3 +70,118 @@ def test_repository_can_retrieve_a_batch_with_allocations(session):
     assert retrieved.sku == expected.sku
     assert retrieved._purchased_quantity == expected._purchased_quantity
     assert retrieved._allocations == {model.OrderLine("order-1", "SMALL_TABLE", 2)}
+
+
+def test_allocated_quantity_is_rebuilt_from_persisted_allocations(session):
+    orderline_id = insert_order_lines(session)
+    batch1_id = insert_batch(session, "batch1")
+    insert_allocation(session, orderline_id, batch1_id)
+    session.commit()
+
+    repo = repository.SqlAlchemyRepository(session)
+    batch = repo.get("batch1")
+    assert batch.allocated_quantity == 2
+
+    batch.allocate(model.OrderLine("order-2", "SMALL_TABLE", 5))
+    assert batch.available_quantity == 13
+
+    session.rollback()
+    assert repo.get("batch1").allocated_quantity == 2
+
+
+def test_repository_lists_only_batches_for_the_requested_sku(session):
+    repo = repository.SqlAlchemyRepository(session)
+    repo.add(model.Batch("batch1", "SMALL_TABLE", qty=20, eta=None))
+    repo.add(model.Batch("batch2", "SMALL_TABLE", qty=20, eta=None))
+    repo.add(model.Batch("batch3", "BLUE_BED", qty=20, eta=None))
+    session.commit()
+
+    retrieved = repo.list_by_sku("SMALL_TABLE")
+
+    assert {b.reference for b in retrieved} == {"batch1", "batch2"}
+    assert repo.list_by_sku("NONEXISTENT") == []
+
+
+def test_batches_added_to_a_loaded_product_are_allocatable(session):
+    repo = repository.SqlAlchemyRepository(session)
+    repo.add(model.Batch("shipment", "SMALL_TABLE", qty=20, eta=date(2011, 1, 2)))
+    session.commit()
+    product = repo.get_product("SMALL_TABLE")
+    assert product.allocate(model.OrderLine("order-1", "SMALL_TABLE", 2)) == "shipment"
+
+    repo.add(model.Batch("in-stock", "SMALL_TABLE", qty=20, eta=None))
+    batchref = product.allocate(model.OrderLine("order-2", "SMALL_TABLE", 2))
+    session.commit()
+
+    assert batchref == "in-stock"
+    assert repo.get_product("SMALL_TABLE").version_number == 3
+
+
+def test_repository_finds_the_batch_an_order_line_is_allocated_to(session):
+    orderline_id = insert_order_lines(session)
+    insert_batch(session, "batch1")
+    batch2_id = insert_batch(session, "batch2")
+    insert_allocation(session, orderline_id, batch2_id)
+
+    repo = repository.SqlAlchemyRepository(session)
+
+    assert repo.get_allocated_batch("order-1", "SMALL_TABLE").reference == "batch2"
+    assert repo.get_allocated_batch("order-2", "SMALL_TABLE") is None
+    assert repo.get_allocated_batch("order-1", "BLUE_BED") is None
+
+
+def statements_per_allocation(engine, session, loading, batches):
+    # every batch but the last is too full for the line, so allocating it
+    # has to look at all of their allocations
+    sku = f"TABLE-{batches}"
+    repo = repository.SqlAlchemyRepository(session, loading)
+    for i in range(batches):
+        qty = 20 if i == batches - 1 else 2
+        eta = date(2011, 1, 1) + timedelta(days=i)
+        batch = model.Batch(f"{sku}-batch-{i}", sku, qty, eta)
+        batch.allocate(model.OrderLine(f"existing-{i}", sku, 1))
+        repo.add(batch)
+    session.commit()
+    session.expunge_all()
+
+    statements = []
+
+    def count(*_):
+        statements.append(1)
+
+    event.listen(engine, "before_cursor_execute", count)
+    services.allocate(model.OrderLine("order-1", sku, 2), repo, session)
+    event.remove(engine, "before_cursor_execute", count)
+    return len(statements)
+
+
+@pytest.mark.parametrize("loading", ["selectin", "joined", "subquery"])
+def test_eager_loading_allocates_in_a_fixed_number_of_statements(
+    in_memory_db, session, loading
+):
+    few = statements_per_allocation(in_memory_db, session, loading, 10)
+    many = statements_per_allocation(in_memory_db, session, loading, 50)
+
+    # load the product, its batches and their allocations; insert the line
+    # and its allocation; bump the product's version
+    assert few == many == {"selectin": 6, "joined": 4, "subquery": 6}[loading]
+
+
+def test_lazy_loading_queries_each_batchs_allocations(in_memory_db, session):
+    few = statements_per_allocation(in_memory_db, session, "lazy", 10)
+    many = statements_per_allocation(in_memory_db, session, "lazy", 50)
+
+    assert few == 15
+    assert many - few == 40
+
+
+def test_loading_strategy_can_be_chosen_per_call(session):
+    repo = repository.SqlAlchemyRepository(session, "lazy")
+    repo.add(model.Batch("batch1", "SMALL_TABLE", qty=20, eta=None))
+    session.commit()
+    session.expunge_all()
+
+    [batch] = repo.list_by_sku("SMALL_TABLE", loading="selectin")
+    assert "_allocations" in vars(batch)
+    with pytest.raises(ValueError):
+        repo.list_by_sku("SMALL_TABLE", loading="eager")
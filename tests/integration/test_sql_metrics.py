@@ -0,0 +1,31 @@
+import pytest
+
+from domain_modelling import instrumentation
+from domain_modelling.adapters import repository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+
+
+@pytest.fixture
+def registry(in_memory_db):
+    registry = instrumentation.MetricsRegistry()
+    instrumentation.configure(registry)
+    instrumentation.instrument_engine(in_memory_db)
+    yield registry
+    instrumentation.configure(None)
+
+
+def test_counts_sql_statements_per_request(registry, session):
+    repo = repository.SqlAlchemyRepository(session)
+    repo.add(model.Batch("b1", "LAMP", 100, eta=None))
+    session.commit()
+
+    request = instrumentation.start_request()
+    services.allocate(model.OrderLine("o1", "LAMP", 10), repo, session)
+    request.finish(endpoint="allocate")
+
+    assert request.statements > 0
+    text = registry.render()
+    assert 'sql_statements_per_request_count{endpoint="allocate"} 1' in text
+    assert 'repository_seconds_count{method="get_product"} 1' in text
+    assert "sql_statement_seconds_count" in text
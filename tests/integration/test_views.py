@@ -0,0 +1,37 @@
+from datetime import date
+
+from domain_modelling import views
+from domain_modelling.adapters import repository
+from domain_modelling.domain import model
+from domain_modelling.service_layer import services
+
+
+def test_available_stock_view(session):
+    repo = repository.SqlAlchemyRepository(session)
+    repo.add(model.Batch("shipment", "SMALL_TABLE", qty=50, eta=date(2011, 1, 2)))
+    repo.add(model.Batch("in-stock", "SMALL_TABLE", qty=10, eta=None))
+    repo.add(model.Batch("other", "BLUE_BED", qty=10, eta=None))
+    session.commit()
+    for orderid, qty in [("order1", 6), ("order2", 4), ("order3", 5)]:
+        services.allocate(model.OrderLine(orderid, "SMALL_TABLE", qty), repo, session)
+
+    assert views.available_stock("SMALL_TABLE", session) == [
+        {
+            "batchref": "in-stock",
+            "eta": None,
+            "purchased": 10,
+            "allocated": 10,
+            "available": 0,
+        },
+        {
+            "batchref": "shipment",
+            "eta": "2011-01-02",
+            "purchased": 50,
+            "allocated": 5,
+            "available": 45,
+        },
+    ]
+
+
+def test_available_stock_view_for_unknown_sku(session):
+    assert views.available_stock("NONEXISTENT", session) == []
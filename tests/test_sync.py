@@ -1,9 +1,26 @@
+import errno
+import hashlib
 import shutil
 import tempfile
 from collections import UserList
 from pathlib import Path
+from types import SimpleNamespace
 
-from domain_modelling.sync import determine_actions, sync
+import pytest
+
+from domain_modelling import sync as sync_module
+from domain_modelling.sync import (
+    HASH_BACKENDS,
+    ActionExecutor,
+    HashCache,
+    LocalFileSystem,
+    determine_actions,
+    hash_file,
+    read_paths_and_hashes,
+    read_tiered_hashes,
+    stream_actions,
+    sync,
+)
 
 
 class FakeFileSystem(UserList):
@@ -92,3 +109,386 @@ def test_when_a_file_has_been_renamed_in_the_source():
     finally:
         shutil.rmtree(source)
         shutil.rmtree(dest)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "tree"
+    (root / "sub").mkdir(parents=True)
+    (root / "a").write_text("first file")
+    (root / "sub" / "b").write_text("second file")
+    return root
+
+
+@pytest.fixture
+def counted_hashes(monkeypatch):
+    hashed = []
+
+    def counting_hash_file(path):
+        hashed.append(path.name)
+        return original_hash_file(path)
+
+    original_hash_file = sync_module.hash_file
+    monkeypatch.setattr(sync_module, "hash_file", counting_hash_file)
+    return hashed
+
+
+def test_read_paths_and_hashes_matches_hash_file(tree):
+    assert read_paths_and_hashes(tree, workers=4) == {
+        hash_file(tree / "a"): "a",
+        hash_file(tree / "sub" / "b"): "b",
+    }
+
+
+def test_hash_cache_skips_unchanged_files(tree, tmp_path, counted_hashes):
+    with HashCache(tmp_path / "hashes.db") as cache:
+        cold = read_paths_and_hashes(tree, cache=cache)
+    with HashCache(tmp_path / "hashes.db") as cache:
+        warm = read_paths_and_hashes(tree, cache=cache)
+
+    assert warm == cold
+    assert sorted(counted_hashes) == ["a", "b"]
+
+
+def test_hash_cache_rehashes_changed_files(tree, tmp_path, counted_hashes):
+    with HashCache(tmp_path / "hashes.db") as cache:
+        read_paths_and_hashes(tree, cache=cache)
+        (tree / "a").write_text("first file, edited")
+        hashes = read_paths_and_hashes(tree, cache=cache)
+
+    assert hashes[hash_file(tree / "a")] == "a"
+    assert sorted(counted_hashes) == ["a", "a", "b"]
+
+
+@pytest.fixture
+def source_and_dest(tmp_path):
+    source, dest = tmp_path / "source", tmp_path / "dest"
+    (source / "sub").mkdir(parents=True)
+    dest.mkdir()
+    (source / "new-file").write_text("only in the source")
+    (source / "sub" / "renamed").write_text("moved around")
+    (source / "same").write_text("unchanged")
+    (dest / "original").write_text("moved around")
+    (dest / "same").write_text("unchanged")
+    (dest / "stale").write_text("only in the destination")
+    return source, dest
+
+
+def test_stream_actions_matches_determine_actions(source_and_dest, tmp_path):
+    source, dest = source_and_dest
+    expected = determine_actions(
+        read_paths_and_hashes(source), read_paths_and_hashes(dest), source, dest
+    )
+
+    actions = stream_actions(source, dest, spill_dir=tmp_path, memory_limit=1024)
+
+    assert sorted(actions) == sorted(expected)
+
+
+def test_stream_actions_yields_before_the_source_is_fully_hashed(
+    source_and_dest, counted_hashes
+):
+    source, dest = source_and_dest
+    for i in range(100):
+        (source / f"extra-{i:03}").write_text(f"extra {i}")
+
+    actions = stream_actions(source, dest, workers=1)
+    first = next(actions)
+    actions.close()
+
+    assert first[0] == "COPY"
+    assert len(counted_hashes) < 3 + 100 + 3
+
+
+def test_executor_runs_every_action_and_reports_progress():
+    filesystem = FakeFileSystem()
+    progress = []
+    actions = [("COPY", Path(f"/src/{i}"), Path(f"/dst/{i}")) for i in range(20)]
+
+    ActionExecutor(workers=4, progress=lambda *args: progress.append(args)).run(
+        filesystem, actions
+    )
+
+    assert sorted(filesystem) == sorted(actions)
+    assert [done for done, total, _ in progress] == list(range(1, 21))
+    assert {total for _, total, _ in progress} == {20}
+
+
+def test_executor_frees_a_name_before_writing_onto_it():
+    src_hashes = {"new": "fn1", "moved": "fn2"}
+    dst_hashes = {"old": "fn1", "moved": "fn3"}
+    filesystem = FakeFileSystem()
+    actions = determine_actions(src_hashes, dst_hashes, Path("/src"), Path("/dst"))
+
+    ActionExecutor(workers=4).run(filesystem, actions)
+
+    assert filesystem.index(("DELETE", Path("/dst/fn1"))) < filesystem.index(
+        ("COPY", Path("/src/fn1"), Path("/dst/fn1"))
+    )
+
+
+def test_executor_stages_moves_that_swap_names(monkeypatch):
+    monkeypatch.setattr(sync_module.uuid, "uuid4", lambda: SimpleNamespace(hex="run"))
+    src_hashes = {"a": "fn1", "b": "fn2"}
+    dst_hashes = {"a": "fn2", "b": "fn1"}
+    filesystem = FakeFileSystem()
+    actions = determine_actions(src_hashes, dst_hashes, Path("/src"), Path("/dst"))
+
+    ActionExecutor(workers=4).run(filesystem, actions)
+
+    assert filesystem == [
+        ("MOVE", Path("/dst/fn2"), Path("/dst/fn2.sync-run-0")),
+        ("MOVE", Path("/dst/fn1"), Path("/dst/fn1.sync-run-1")),
+        ("MOVE", Path("/dst/fn2.sync-run-0"), Path("/dst/fn1")),
+        ("MOVE", Path("/dst/fn1.sync-run-1"), Path("/dst/fn2")),
+    ]
+
+
+def test_executor_staging_leaves_existing_files_alone(tmp_path):
+    (tmp_path / "fn1").write_text("b")
+    (tmp_path / "fn2").write_text("a")
+    # what the staging names used to be; neither may be overwritten
+    (tmp_path / "fn1.sync-1").write_text("unrelated")
+    (tmp_path / "fn2.sync-0").write_text("unrelated")
+    src_hashes = {"a": "fn1", "b": "fn2"}
+    dst_hashes = {"a": "fn2", "b": "fn1"}
+    filesystem = LocalFileSystem()
+    actions = determine_actions(src_hashes, dst_hashes, Path("/src"), tmp_path)
+
+    ActionExecutor(workers=4).run(filesystem, actions)
+
+    assert sorted((path.name, path.read_text()) for path in tmp_path.iterdir()) == [
+        ("fn1", "a"),
+        ("fn1.sync-1", "unrelated"),
+        ("fn2", "b"),
+        ("fn2.sync-0", "unrelated"),
+    ]
+
+
+class FlakyFileSystem(FakeFileSystem):
+    def __init__(self, failures, error):
+        super().__init__()
+        self.failures = failures
+        self.error = error
+
+    def copy(self, source, dest):
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        super().copy(source, dest)
+
+
+def test_executor_retries_transient_failures():
+    filesystem = FlakyFileSystem(2, OSError(errno.ETIMEDOUT, "timed out"))
+
+    ActionExecutor(attempts=3, backoff=0).run(
+        filesystem, [("COPY", Path("/src/fn1"), Path("/dst/fn1"))]
+    )
+
+    assert filesystem == [("COPY", Path("/src/fn1"), Path("/dst/fn1"))]
+
+
+def test_executor_raises_permanent_failures():
+    filesystem = FlakyFileSystem(1, PermissionError(errno.EACCES, "denied"))
+
+    with pytest.raises(PermissionError):
+        ActionExecutor(attempts=3, backoff=0).run(
+            filesystem, [("COPY", Path("/src/fn1"), Path("/dst/fn1"))]
+        )
+
+    assert filesystem == []
+
+
+def test_sync_hands_actions_to_the_executor():
+    reader = {"/source": {"sha1": "fn1"}, "/dest": {}}
+    filesystem = FakeFileSystem()
+
+    sync(
+        "/source",
+        "/dest",
+        reader=reader.pop,
+        filesystem=filesystem,
+        executor=ActionExecutor(),
+    )
+
+    assert filesystem == [("COPY", Path("/source/fn1"), Path("/dest/fn1"))]
+
+
+def write_large_file(path, middle=b"m", size=4 * 65536):
+    ends = b"e" * 65536
+    path.write_bytes(ends + middle * (size - 2 * len(ends)) + ends)
+
+
+@pytest.fixture
+def large_trees(tmp_path):
+    source, dest = tmp_path / "source", tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    return source, dest
+
+
+def tiered_actions(source, dest, **kwargs):
+    source_hashes, dst_hashes = read_tiered_hashes(source, dest, **kwargs)
+    return sorted(determine_actions(source_hashes, dst_hashes, source, dest))
+
+
+def test_tiered_hashes_never_read_files_with_unique_sizes(large_trees, counted_hashes):
+    source, dest = large_trees
+    write_large_file(source / "new", size=5 * 65536)
+    write_large_file(dest / "old", size=6 * 65536)
+
+    assert tiered_actions(source, dest) == [
+        ("COPY", source / "new", dest / "new"),
+        ("DELETE", dest / "old"),
+    ]
+    assert counted_hashes == []
+
+
+def test_tiered_hashes_only_fully_hash_when_partial_hashes_collide(
+    large_trees, counted_hashes
+):
+    source, dest = large_trees
+    write_large_file(source / "renamed")
+    write_large_file(dest / "original")
+    write_large_file(source / "edited", middle=b"x")
+    write_large_file(dest / "edited", middle=b"y")
+    (source / "different-start").write_bytes(b"s" * 4 * 65536)
+
+    assert tiered_actions(source, dest) == [
+        ("COPY", source / "different-start", dest / "different-start"),
+        ("COPY", source / "edited", dest / "edited"),
+        ("DELETE", dest / "edited"),
+        ("MOVE", dest / "original", dest / "renamed"),
+    ]
+    assert sorted(counted_hashes) == ["edited", "edited", "original", "renamed"]
+
+
+def test_strict_tiered_hashes_hash_every_file(large_trees, counted_hashes):
+    source, dest = large_trees
+    write_large_file(source / "new", size=5 * 65536)
+    write_large_file(dest / "old", size=6 * 65536)
+
+    assert tiered_actions(source, dest, strict=True) == [
+        ("COPY", source / "new", dest / "new"),
+        ("DELETE", dest / "old"),
+    ]
+    assert sorted(counted_hashes) == ["new", "old"]
+
+
+def test_tiered_hashes_read_nothing_the_cache_already_has(
+    large_trees, tmp_path, counted_hashes, monkeypatch
+):
+    source, dest = large_trees
+    write_large_file(source / "renamed")
+    write_large_file(dest / "original")
+    write_large_file(source / "edited", middle=b"x")
+    write_large_file(dest / "edited", middle=b"y")
+    (source / "small").write_text("small")
+    (dest / "small-renamed").write_text("small")
+
+    with HashCache(tmp_path / "hashes.db") as cache:
+        first = tiered_actions(source, dest, cache=cache)
+        counted_hashes.clear()
+        partials = []
+        monkeypatch.setattr(sync_module, "partial_hash", partials.append)
+        assert tiered_actions(source, dest, cache=cache) == first
+
+    assert counted_hashes == []
+    assert partials == []
+
+
+def test_sync_can_compare_the_trees_tiered(large_trees):
+    source, dest = large_trees
+    write_large_file(source / "renamed")
+    write_large_file(dest / "original")
+    write_large_file(dest / "unwanted", size=5 * 65536)
+
+    sync(source, dest, tiered=True)
+
+    assert sorted(path.name for path in dest.iterdir()) == ["renamed"]
+
+
+def test_local_filesystem_copies_a_cached_file_without_rehashing(
+    tree, tmp_path, counted_hashes
+):
+    dest = tmp_path / "copy"
+    with HashCache(tmp_path / "hashes.db") as cache:
+        read_paths_and_hashes(tree, cache=cache)
+        LocalFileSystem(cache).copy(tree / "a", dest)
+        cached = cache.get(dest, dest.stat())
+
+    assert dest.read_text() == "first file"
+    assert cached == hash_file(tree / "a")
+    assert sorted(counted_hashes) == ["a", "b"]
+
+
+def test_local_filesystem_hashes_an_uncached_file_while_copying(
+    tree, tmp_path, counted_hashes
+):
+    dest = tmp_path / "copy"
+    with HashCache(tmp_path / "hashes.db") as cache:
+        LocalFileSystem(cache, blocksize=4).copy(tree / "a", dest)
+        cached = cache.get(dest, dest.stat())
+
+    assert dest.read_text() == "first file"
+    assert cached == hash_file(tree / "a")
+    assert counted_hashes == []
+
+
+def test_local_filesystem_copies_in_the_kernel_without_a_cache(
+    tree, tmp_path, monkeypatch
+):
+    copied_in_kernel = []
+
+    def spy(fsrc, fdst):
+        copied_in_kernel.append(Path(fsrc.name).name)
+        return original(fsrc, fdst)
+
+    original = sync_module._copy_in_kernel
+    monkeypatch.setattr(sync_module, "_copy_in_kernel", spy)
+    monkeypatch.setattr(sync_module.hashlib, "sha1", None)
+    dest = tmp_path / "copy"
+
+    LocalFileSystem().copy(tree / "a", dest)
+
+    assert dest.read_text() == "first file"
+    assert copied_in_kernel == ["a"]
+
+
+def test_local_filesystem_falls_back_when_kernel_copies_are_unsupported(
+    tree, tmp_path, monkeypatch
+):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, "cross-device")
+
+    for method in ("_reflink", "_copy_file_range", "_sendfile"):
+        monkeypatch.setattr(sync_module, method, unsupported)
+    dest = tmp_path / "copy"
+    with HashCache(tmp_path / "hashes.db") as cache:
+        read_paths_and_hashes(tree, cache=cache)
+        LocalFileSystem(cache).copy(tree / "a", dest)
+
+    assert dest.read_text() == "first file"
+
+
+def test_local_filesystem_moves_keep_their_cached_hash(tree, tmp_path):
+    dest = tree / "renamed"
+    with HashCache(tmp_path / "hashes.db") as cache:
+        read_paths_and_hashes(tree, cache=cache)
+        LocalFileSystem(cache).move(tree / "a", dest)
+        cached = cache.get(dest, dest.stat())
+
+    assert not (tree / "a").exists()
+    assert cached == hash_file(dest)
+
+
+@pytest.mark.parametrize("backend", [None, *sorted(HASH_BACKENDS)])
+@pytest.mark.parametrize("size", [0, 1, 4096, 65536 * 3 + 5])
+def test_hash_backends_agree_with_hashlib(tmp_path, backend, size):
+    path = tmp_path / "file"
+    contents = bytes(i % 251 for i in range(size))
+    path.write_bytes(contents)
+
+    sha = hash_file(path, blocksize=4096, backend=backend)
+
+    assert sha == hashlib.sha1(contents).hexdigest()
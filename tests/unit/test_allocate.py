@@ -2,7 +2,15 @@ from datetime import date, timedelta
 
 import pytest
 
-from domain_modelling.domain.model import Batch, OrderLine, OutOfStock, allocate
+from domain_modelling.domain.model import (
+    AllocationIndex,
+    Batch,
+    NotAllocated,
+    OrderLine,
+    OutOfStock,
+    Product,
+    allocate,
+)
 
 today = date.today()
 tomorrow = date.today() + timedelta(days=1)
@@ -49,7 +57,19 @@ def test_lt():
 
     assert earliest < medium
     assert none < earliest
-    assert earliest < same
+    assert not earliest < same
+    assert not same < earliest
+
+
+def test_sorting_does_not_depend_on_input_order():
+    shipment_b = Batch("b-shipment", "MINIMALIST_SPOON", 100, eta=tomorrow)
+    shipment_a = Batch("a-shipment", "MINIMALIST_SPOON", 100, eta=tomorrow)
+    in_stock = Batch("z-in-stock", "MINIMALIST_SPOON", 100, eta=None)
+    expected = [in_stock, shipment_a, shipment_b]
+
+    assert sorted([shipment_b, shipment_a, in_stock]) == expected
+    assert sorted([in_stock, shipment_a, shipment_b]) == expected
+    assert sorted([shipment_a, in_stock, shipment_b]) == expected
 
 
 def test_raised_out_of_stock_exception_if_can_not_allocate():
@@ -58,3 +78,77 @@ def test_raised_out_of_stock_exception_if_can_not_allocate():
 
     with pytest.raises(OutOfStock, match="SMALL_TABLE"):
         allocate(OrderLine("order-2", "SMALL_TABLE", qty=1), [batch])
+
+
+def test_product_allocation_increments_version_number():
+    batch = Batch("batch-001", "SMALL_TABLE", qty=20, eta=None)
+    product = Product(sku="SMALL_TABLE", batches=[batch], version_number=7)
+
+    batchref = product.allocate(OrderLine("order-1", "SMALL_TABLE", qty=10))
+
+    assert batchref == "batch-001"
+    assert product.version_number == 8
+
+
+def test_product_version_number_is_unchanged_when_out_of_stock():
+    batch = Batch("batch-001", "SMALL_TABLE", qty=5, eta=None)
+    product = Product(sku="SMALL_TABLE", batches=[batch], version_number=3)
+
+    with pytest.raises(OutOfStock):
+        product.allocate(OrderLine("order-1", "SMALL_TABLE", qty=10))
+    assert product.version_number == 3
+
+
+def test_allocation_index_keeps_batches_in_preference_order():
+    later_batch = Batch("later", "SMALL_TABLE", 100, eta=later)
+    in_stock_batch = Batch("in-stock", "SMALL_TABLE", 100, eta=None)
+    index = AllocationIndex([later_batch, in_stock_batch])
+
+    tomorrow_batch = Batch("tomorrow", "SMALL_TABLE", 100, eta=tomorrow)
+    index.add(tomorrow_batch)
+
+    assert list(index) == [in_stock_batch, tomorrow_batch, later_batch]
+
+
+def test_product_reorders_batches_when_eta_changes():
+    early = Batch("early", "SMALL_TABLE", 100, eta=tomorrow)
+    late = Batch("late", "SMALL_TABLE", 100, eta=later)
+    product = Product(sku="SMALL_TABLE", batches=[early, late])
+
+    product.change_batch_eta("late", today)
+
+    assert late.eta == today
+    assert list(product.allocation_index) == [late, early]
+    assert product.allocate(OrderLine("order-1", "SMALL_TABLE", 10)) == "late"
+
+
+def test_product_allocates_to_batches_added_after_indexing():
+    shipment = Batch("shipment", "SMALL_TABLE", 100, eta=tomorrow)
+    product = Product(sku="SMALL_TABLE", batches=[shipment])
+    product.allocate(OrderLine("order-1", "SMALL_TABLE", 10))
+
+    in_stock = Batch("in-stock", "SMALL_TABLE", 100, eta=None)
+    product.add_batch(in_stock)
+
+    assert product.allocate(OrderLine("order-2", "SMALL_TABLE", 10)) == "in-stock"
+    assert product.batches == [shipment, in_stock]
+
+
+def test_product_deallocation_frees_stock_and_increments_version_number():
+    batch = Batch("batch-001", "SMALL_TABLE", qty=20, eta=None)
+    product = Product(sku="SMALL_TABLE", batches=[batch])
+    product.allocate(OrderLine("order-1", "SMALL_TABLE", qty=10))
+
+    line = product.deallocate("batch-001", "order-1")
+
+    assert line == OrderLine("order-1", "SMALL_TABLE", qty=10)
+    assert batch.available_quantity == 20
+    assert product.version_number == 2
+
+
+def test_product_deallocation_errors_for_unallocated_order():
+    batch = Batch("batch-001", "SMALL_TABLE", qty=20, eta=None)
+    product = Product(sku="SMALL_TABLE", batches=[batch])
+
+    with pytest.raises(NotAllocated, match="order-1"):
+        product.deallocate("batch-001", "order-1")
@@ -1,6 +1,10 @@
-from domain_modelling.model import Batch, OrderLine
 from datetime import date
 
+import pytest
+
+from domain_modelling.domain import model
+from domain_modelling.domain.model import Batch, OrderLine
+
 
 def test_allocating_to_a_batch_reduces_the_available_quantity():
     batch = Batch("batch-001", "SMALL_TABLE", qty=20, eta=date.today())
@@ -50,3 +54,27 @@ def test_allocation_is_idempotent():
     batch.allocate(line)
     batch.allocate(line)
     assert batch.available_quantity == 18
+
+
+def test_deallocating_restores_the_available_quantity():
+    batch, line = make_batch_and_line("ELEGANT_LAMP", 20, 2)
+    batch.allocate(line)
+    batch.deallocate(line)
+    batch.deallocate(line)
+    assert batch.allocated_quantity == 0
+    assert batch.available_quantity == 20
+
+
+def test_allocated_quantity_is_rebuilt_when_reset():
+    batch, line = make_batch_and_line("ELEGANT_LAMP", 20, 2)
+    batch.allocate(line)
+    batch._allocated_quantity = None
+    assert batch.allocated_quantity == 2
+
+
+def test_consistency_check_catches_allocations_changed_behind_our_back():
+    batch, line = make_batch_and_line("ELEGANT_LAMP", 20, 2)
+    batch._allocations.add(line)
+    assert model.CHECK_ALLOCATED_QUANTITY
+    with pytest.raises(AssertionError, match="batch-001"):
+        batch.allocated_quantity
@@ -0,0 +1,62 @@
+import logging
+
+import pytest
+
+from domain_modelling import instrumentation
+from domain_modelling.adapters.repository import FakeRepository
+from domain_modelling.domain.model import Batch, OrderLine
+from domain_modelling.service_layer import services
+
+
+class FakeSession:
+    def commit(self):
+        pass
+
+
+@pytest.fixture
+def registry():
+    registry = instrumentation.MetricsRegistry()
+    instrumentation.configure(registry)
+    yield registry
+    instrumentation.configure(None)
+
+
+def test_timers_are_shared_no_ops_when_turned_off():
+    assert instrumentation.timer("a") is instrumentation.timer("b")
+    assert instrumentation.start_request() is None
+
+
+def test_registry_renders_counters_and_histograms(registry):
+    instrumentation.increment("conflicts_total", reason="stale")
+    instrumentation.increment("conflicts_total", 2, reason="stale")
+    instrumentation.observe("latency_seconds", 0.003, layer="service")
+
+    text = registry.render()
+
+    assert 'conflicts_total{reason="stale"} 3' in text
+    assert 'latency_seconds_bucket{layer="service",le="0.0025"} 0' in text
+    assert 'latency_seconds_bucket{layer="service",le="0.005"} 1' in text
+    assert 'latency_seconds_bucket{layer="service",le="+Inf"} 1' in text
+    assert 'latency_seconds_count{layer="service"} 1' in text
+
+
+def test_services_time_each_layer(registry):
+    repo = FakeRepository([Batch("b1", "LAMP", 100, eta=None)])
+
+    services.allocate(OrderLine("o1", "LAMP", 10), repo, FakeSession())
+
+    text = registry.render()
+    assert 'service_seconds_count{operation="allocate"} 1' in text
+    assert 'domain_seconds_count{operation="allocate"} 1' in text
+    assert "commit_seconds_count 1" in text
+
+
+def test_log_sink_logs_each_observation(caplog):
+    instrumentation.configure(instrumentation.LogSink(logging.getLogger("metrics")))
+    try:
+        with caplog.at_level(logging.INFO, logger="metrics"):
+            instrumentation.increment("allocations_total", sku="LAMP")
+    finally:
+        instrumentation.configure(None)
+
+    assert caplog.messages == ['allocations_total{sku="LAMP"} +1']
@@ -0,0 +1,95 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from domain_modelling.domain import model
+from domain_modelling.domain.model import Batch, OrderLine
+
+pytest.importorskip("numpy")
+
+from domain_modelling.domain.planning import VectorisedAllocator  # noqa: E402
+
+today = date.today()
+
+
+def random_stock(rng):
+    specs = []
+    for i in range(rng.randint(0, 12)):
+        eta = None if rng.random() < 0.3 else today + timedelta(days=rng.randint(0, 5))
+        specs.append((f"batch-{i:02d}", rng.choice("ABC"), rng.randint(0, 2000), eta))
+    return specs
+
+
+def random_lines(rng):
+    return [
+        OrderLine(f"order-{i}", rng.choice("ABCD"), rng.randint(0, 15))
+        for i in range(rng.randint(0, 1000))
+    ]
+
+
+def allocate_one_at_a_time(batches, lines):
+    results = []
+    for line in lines:
+        try:
+            results.append(model.allocate(line, batches))
+        except model.OutOfStock as e:
+            results.append(e)
+    return results
+
+
+def describe(results):
+    return [r if isinstance(r, str) else (type(r), str(r)) for r in results]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_matches_allocating_one_line_at_a_time(seed):
+    rng = random.Random(seed)
+    specs, lines = random_stock(rng), random_lines(rng)
+    batches = [Batch(*spec) for spec in specs]
+    allocator = VectorisedAllocator(Batch(*spec) for spec in specs)
+
+    expected = allocate_one_at_a_time(batches, lines)
+
+    assert describe(allocator.allocate(lines)) == describe(expected)
+    assert allocator.available_quantities() == {
+        b.reference: b.available_quantity for b in batches
+    }
+
+
+def test_prefers_stock_then_earliest_eta_then_reference():
+    allocator = VectorisedAllocator(
+        [
+            Batch("later", "LAMP", 10, eta=today + timedelta(days=2)),
+            Batch("b-soon", "LAMP", 10, eta=today + timedelta(days=1)),
+            Batch("a-soon", "LAMP", 10, eta=today + timedelta(days=1)),
+            Batch("in-stock", "LAMP", 10, eta=None),
+        ]
+    )
+
+    assert allocator.references("LAMP") == ["in-stock", "a-soon", "b-soon", "later"]
+
+
+def test_long_streams_fill_batches_in_order():
+    allocator = VectorisedAllocator(
+        [
+            Batch("first", "LAMP", 1000, eta=None),
+            Batch("second", "LAMP", 1000, eta=today),
+        ]
+    )
+    lines = [OrderLine(f"order-{i}", "LAMP", 3) for i in range(700)]
+
+    results = allocator.allocate(lines)
+
+    assert results[:333] == ["first"] * 333
+    assert results[333:666] == ["second"] * 333
+    assert all(isinstance(r, model.OutOfStock) for r in results[666:])
+    assert allocator.available_quantities() == {"first": 1, "second": 1}
+
+
+def test_does_not_change_the_batches():
+    batch = Batch("batch", "LAMP", 10, eta=None)
+
+    VectorisedAllocator([batch]).allocate([OrderLine("order", "LAMP", 4)])
+
+    assert batch.available_quantity == 10
@@ -72,3 +72,83 @@ def test_commits():
 
     services.allocate(line, repo, session)
     assert session.committed is True
+
+
+class CountingRepository(FakeRepository):
+    def __init__(self, batches):
+        super().__init__(batches)
+        self.products_loaded = []
+
+    def get_product(self, sku):
+        self.products_loaded.append(sku)
+        return super().get_product(sku)
+
+
+def test_allocate_many_reports_a_result_per_line():
+    lamp = model.Batch("b1", "COMPLICATED_LAMP", 20, eta=None)
+    chair = model.Batch("b2", "FLIMSY_CHAIR", 5, eta=None)
+    repo = FakeRepository([lamp, chair])
+    lines = [
+        model.OrderLine("o1", "COMPLICATED_LAMP", 10),
+        model.OrderLine("o1", "FLIMSY_CHAIR", 10),
+        model.OrderLine("o1", "NONEXISTENTSKU", 1),
+        model.OrderLine("o2", "COMPLICATED_LAMP", 10),
+    ]
+
+    results = services.allocate_many(lines, repo, FakeSession())
+
+    assert results[0] == "b1"
+    assert isinstance(results[1], model.OutOfStock)
+    assert isinstance(results[2], services.InvalidSku)
+    assert results[3] == "b1"
+    assert lamp.available_quantity == 0
+    assert chair.available_quantity == 5
+
+
+def test_allocate_many_loads_each_sku_once_and_commits_once():
+    batch = model.Batch("b1", "COMPLICATED_LAMP", 100, eta=None)
+    repo = CountingRepository([batch])
+    session = FakeSession()
+    lines = [model.OrderLine(f"o{i}", "COMPLICATED_LAMP", 1) for i in range(20)]
+
+    results = services.allocate_many(lines, repo, session)
+
+    assert results == ["b1"] * 20
+    assert repo.products_loaded == ["COMPLICATED_LAMP"]
+    assert session.committed is True
+
+
+def test_deallocate_frees_the_allocated_quantity():
+    batch = model.Batch("b1", "BLUE_PLINTH", 100, eta=None)
+    repo = FakeRepository([batch])
+    session = FakeSession()
+    services.allocate(model.OrderLine("o1", "BLUE_PLINTH", 10), repo, session)
+
+    batchref = services.deallocate("o1", "BLUE_PLINTH", repo, session)
+
+    assert batchref == "b1"
+    assert batch.available_quantity == 100
+    assert repo.get_product("BLUE_PLINTH").version_number == 2
+
+
+def test_deallocate_errors_for_unallocated_order():
+    batch = model.Batch("b1", "BLUE_PLINTH", 100, eta=None)
+    repo = FakeRepository([batch])
+
+    with pytest.raises(model.NotAllocated, match="o1"):
+        services.deallocate("o1", "BLUE_PLINTH", repo, FakeSession())
+
+
+def test_reallocate_moves_the_line_to_the_preferred_batch():
+    shipment_batch = model.Batch("shipment", "BLUE_PLINTH", 100, eta=tomorrow)
+    repo = FakeRepository([shipment_batch])
+    session = FakeSession()
+    services.allocate(model.OrderLine("o1", "BLUE_PLINTH", 10), repo, session)
+    in_stock_batch = model.Batch("in-stock", "BLUE_PLINTH", 100, eta=None)
+    repo.add(in_stock_batch)
+
+    batchref = services.reallocate("o1", "BLUE_PLINTH", repo, session)
+
+    assert batchref == "in-stock"
+    assert in_stock_batch.available_quantity == 90
+    assert shipment_batch.available_quantity == 100
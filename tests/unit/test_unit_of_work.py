@@ -0,0 +1,31 @@
+import pytest
+
+from domain_modelling.service_layer.unit_of_work import session_scope
+
+
+class FakeSession:
+    rolled_back = False
+    closed = False
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = True
+
+
+def test_session_is_closed_after_the_block():
+    with session_scope(FakeSession) as session:
+        pass
+
+    assert session.closed
+    assert not session.rolled_back
+
+
+def test_session_is_rolled_back_and_closed_on_error():
+    with pytest.raises(ValueError):
+        with session_scope(FakeSession) as session:
+            raise ValueError("boom")
+
+    assert session.rolled_back
+    assert session.closed